@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+# measures how the stages of MainDraw.py scale with the number of atoms on synthetic LAMMPS dump files
+
+import os
+import sys
+import json
+import math
+import mmap
+import time
+import random
+import shutil
+import platform
+import tempfile
+import subprocess
+import multiprocessing
+
+import MainDraw
+
+class UnknownArgument(Exception):
+    pass
+
+class UnknownLattice(Exception):
+    pass
+
+class InvalidNumberOfAtoms(Exception):
+    pass
+
+class InvalidNumberOfFrames(Exception):
+    pass
+
+# positions of the atoms in the unit cell of the lattices
+LATTICE_BASIS = {
+    "fcc": ((0., 0., 0.), (.5, .5, 0.), (.5, 0., .5), (0., .5, .5)),
+    "bcc": ((0., 0., 0.), (.5, .5, .5)),
+}
+LATTICES = ("fcc", "bcc", "gas")
+# lattice constant; also the mean distance of the atoms of the gas
+LATTICE_CONSTANT = 1.6
+# number of lines written at once
+GENERATE_BLOCK_SIZE = 1 << 16
+
+# writes a dump with frames snapshots of number_atoms atoms in a cubic box to
+# filename. the atoms sit on an fcc or bcc lattice (the last unit cells are
+# only partly filled) or are randomly distributed for gas; in later frames
+# they are slightly displaced. positions are scaled (xs, ys, zs) or not. the
+# positions are computed block by block from the index of the atom, so the
+# memory does not grow with the number of atoms
+def generate_dump(filename, number_atoms, lattice="fcc", scaled=True, frames=1, num_types=2, seed=1):
+    rng = random.Random(seed)
+    if lattice == "gas":
+        cells = max(1, round(number_atoms ** (1. / 3.)))
+    else:
+        basis = LATTICE_BASIS[lattice]
+        cells = max(1, math.ceil((number_atoms / len(basis)) ** (1. / 3.)))
+    length = cells * LATTICE_CONSTANT
+    with open(filename, 'w') as dumpfile:
+        for frame in range(frames):
+            dumpfile.write('ITEM: TIMESTEP\n%d\n' % (100 * frame))
+            dumpfile.write('ITEM: NUMBER OF ATOMS\n%d\n' % number_atoms)
+            dumpfile.write('ITEM: BOX BOUNDS pp pp pp\n')
+            for i in range(3):
+                dumpfile.write('%r %r\n' % (0., length))
+            if scaled:
+                dumpfile.write('ITEM: ATOMS id type xs ys zs\n')
+                factor = 1. / cells
+            else:
+                dumpfile.write('ITEM: ATOMS id type x y z\n')
+                factor = LATTICE_CONSTANT
+            amplitude = .05 * frame
+            for start in range(0, number_atoms, GENERATE_BLOCK_SIZE):
+                stop = min(start + GENERATE_BLOCK_SIZE, number_atoms)
+                if lattice == "gas":
+                    # every frame draws the same positions of the block
+                    gas_rng = random.Random('%d %d' % (seed, start))
+                lines = []
+                for i in range(start, stop):
+                    if lattice == "gas":
+                        x, y, z = gas_rng.random() * cells, gas_rng.random() * cells, gas_rng.random() * cells
+                    else:
+                        cell, b = divmod(i, len(basis))
+                        bx, by, bz = basis[b]
+                        x, y, z = cell // (cells * cells) + bx, cell // cells % cells + by, cell % cells + bz
+                    if amplitude > 0:
+                        x += amplitude * (rng.random() - .5)
+                        y += amplitude * (rng.random() - .5)
+                        z += amplitude * (rng.random() - .5)
+                    lines.append('%d %d %.6g %.6g %.6g\n' % (i + 1, 1 + i % num_types, factor * x, factor * y, factor * z))
+                dumpfile.write(''.join(lines))
+
+# measures the stages of drawing the first snapshot of dump_filename with
+# projection and orientation. runs in a process of its own, so that the peak
+# memory belongs to this run only. returns the results per stage
+def run_stages(dump_filename, tex_filename, projection, orientation, latex):
+    stages = {}
+    def record(name, start, atoms):
+        seconds = time.perf_counter() - start
+        stages[name] = {
+            'seconds': seconds,
+            'atoms_per_second': atoms / seconds if atoms is not None and seconds > 0 else None,
+            'peak_rss_mb': MainDraw.peak_rss(),
+        }
+    options = MainDraw.DrawOptions()
+    options.projection = projection
+    options.orientation = orientation
+
+    with open(dump_filename, 'rb') as lammpsfile:
+        mm = mmap.mmap(lammpsfile.fileno(), 0, access=mmap.ACCESS_READ)
+        start = time.perf_counter()
+        offsets = MainDraw.scan_frame_offsets(mm)
+        record('index', start, None)
+        mm.seek(0)
+        start = time.perf_counter()
+        header = MainDraw.read_snapshot_header(mm)
+        types, xs, ys, zs = MainDraw.read_atoms(mm, header)
+        record('parse', start, len(types))
+        mm.close()
+    n = len(types)
+
+    start = time.perf_counter()
+    columns = []
+    for (factor, offset), column in zip(header.coordinate_transforms(), (xs, ys, zs)):
+        if factor != 1. or offset != 0.:
+            column = MainDraw.affine_transformed(column, factor, offset)
+        columns.append(column)
+    xs, ys, zs = columns
+    record('unscale', start, n)
+
+    start = time.perf_counter()
+    view = MainDraw.Projection(projection, orientation)
+    width, height = view.extent(header.box)
+    scale = min(options.target_width / width, options.target_height / height)
+    xs, ys, zs = (MainDraw.affine_transformed(column, scale, 0.) for column in (xs, ys, zs))
+    record('scale', start, n)
+
+    start = time.perf_counter()
+    order = view.sort(xs, ys, zs)
+    record('sort', start, n)
+
+    start = time.perf_counter()
+    with open(tex_filename, 'w') as outfile:
+        MainDraw.write_atom_lines(outfile, order, types, xs, ys, zs, .8 * scale, options)
+    record('write', start, n)
+
+    if latex:
+        # compile a complete document of the snapshot
+        with open(dump_filename, 'rb') as lammpsfile:
+            mm = mmap.mmap(lammpsfile.fileno(), 0, access=mmap.ACCESS_READ)
+            header, types, xs, ys, zs = MainDraw.read_snapshot(mm)
+            mm.close()
+        with open(tex_filename, 'w') as outfile:
+            MainDraw.draw_snapshot(header, types, xs, ys, zs, outfile, options)
+        start = time.perf_counter()
+        returncode, log_filename = MainDraw.compile_document(tex_filename)
+        record('pdflatex', start, n)
+        stages['pdflatex']['returncode'] = returncode
+    return {'frames': len(offsets), 'stages': stages}
+
+# prints the change of the time of every stage compared to the results of an
+# earlier benchmark
+def compare_results(results, old_results):
+    old = {}
+    for result in old_results:
+        old[(result['atoms'], result['lattice'], result['scaled'], result['projection'], result['orientation'])] = result['stages']
+    for result in results:
+        key = (result['atoms'], result['lattice'], result['scaled'], result['projection'], result['orientation'])
+        if key not in old:
+            continue
+        changes = []
+        for name, stage in result['stages'].items():
+            if name in old[key] and old[key][name]['seconds'] > 0:
+                changes.append('%s %.2fx' % (name, stage['seconds'] / old[key][name]['seconds']))
+        print('  %d atoms %s %s %s %s: %s' % (key[0], key[1], 'scaled' if key[2] else 'unscaled', key[3], key[4], ', '.join(changes)))
+
+if __name__ == '__main__':
+    usage = "\n Usage: ./Benchmark.py arguments\n arguments are optional and can be:\n atoms=1000,10000,100000\n lattice=[fcc|bcc|gas]\n unscaled\n frames=1\n projections=cabinet,isometric,dimetric\n orientations=xyz,zxy,yzx\n latex\n output=benchmark.json\n compare=old_benchmark.json\n generate=file.dump\n latex compiles a complete document of every run if pdflatex is available. generate only writes a dump of the first number of atoms to file.dump."
+    atom_counts = [1000, 10000, 100000]
+    lattice = "fcc"
+    scaled = True
+    frames = 1
+    projections = list(MainDraw.AXIS_VECTORS)
+    orientations = list(MainDraw.ORIENTATIONS)
+    latex = False
+    output = "benchmark.json"
+    compare = None
+    generate = None
+    for argument in sys.argv[1:]:
+        arg = argument.split("=")
+        if arg[0] == "atoms":
+            try:
+                atom_counts = [int(float(a)) for a in arg[1].split(',')]
+            except:
+                raise InvalidNumberOfAtoms("\n ERROR: " + arg[1] + " is not an valid list of numbers of atoms.")
+            if min(atom_counts) <= 0:
+                raise InvalidNumberOfAtoms("\n ERROR: " + arg[1] + " is not an valid list of numbers of atoms.")
+        elif arg[0] == "lattice":
+            if arg[1] not in LATTICES:
+                raise UnknownLattice("\n ERROR: " + arg[1] + " is not an valid lattice. Only use 'fcc', 'bcc', or 'gas'")
+            lattice = arg[1]
+        elif arg[0] == "unscaled":
+            scaled = False
+        elif arg[0] == "frames":
+            try:
+                frames = int(arg[1])
+            except:
+                raise InvalidNumberOfFrames("\n ERROR: " + arg[1] + " is not an valid number of frames.")
+            if frames <= 0:
+                raise InvalidNumberOfFrames("\n ERROR: " + arg[1] + " is not an valid number of frames.")
+        elif arg[0] == "projections":
+            projections = arg[1].split(',')
+            for projection in projections:
+                if projection not in MainDraw.AXIS_VECTORS:
+                    raise MainDraw.UnknownProjectionMode("\n ERROR: " + projection + " is not an valid projection. Only use 'cabinet', 'isometric', or 'dimetric'")
+        elif arg[0] == "orientations":
+            orientations = arg[1].split(',')
+            for orientation in orientations:
+                if orientation not in MainDraw.ORIENTATIONS:
+                    raise MainDraw.UnknownOrientation("\n ERROR: " + orientation + " is not an valid orientation. Only use 'xyz', 'zxy', or 'yzx'")
+        elif arg[0] == "latex":
+            latex = True
+        elif arg[0] == "output":
+            output = arg[1]
+        elif arg[0] == "compare":
+            compare = arg[1]
+        elif arg[0] == "generate":
+            generate = arg[1]
+        else:
+            raise UnknownArgument("\n ERROR: " + arg[0] + " is not an valid argument." + usage)
+
+    if generate is not None:
+        print("Writing " + str(atom_counts[0]) + " atoms to " + generate)
+        generate_dump(generate, atom_counts[0], lattice, scaled, frames)
+        sys.exit(0)
+
+    if latex and shutil.which(MainDraw.COMPILE_COMMAND[0]) is None:
+        print("pdflatex not found, the compilation is not measured")
+        latex = False
+    # every run gets a fresh process, so that the peak memory is its own
+    context = multiprocessing.get_context('spawn')
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for number_atoms in atom_counts:
+            dump_filename = os.path.join(directory, 'benchmark.dump')
+            print("Generating " + str(number_atoms) + " atoms (" + lattice + ") ...")
+            generate_dump(dump_filename, number_atoms, lattice, scaled, frames)
+            for projection in projections:
+                for orientation in orientations:
+                    tex_filename = os.path.join(directory, 'benchmark.tex')
+                    with context.Pool(1) as pool:
+                        result = pool.apply(run_stages, (dump_filename, tex_filename, projection, orientation, latex))
+                    result.update({'atoms': number_atoms, 'lattice': lattice, 'scaled': scaled, 'projection': projection, 'orientation': orientation})
+                    results.append(result)
+                    print('  %s %s: ' % (projection, orientation) + ', '.join('%s %.3fs' % (name, stage['seconds']) for name, stage in result['stages'].items())
+                          + ', peak %.0f MB' % max(stage['peak_rss_mb'] for stage in result['stages'].values()))
+
+    try:
+        version = subprocess.check_output(['git', 'describe', '--always', '--dirty'], cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        version = None
+    with open(output, 'w') as outfile:
+        json.dump({'version': version, 'python': platform.python_version(), 'machine': platform.machine(), 'results': results}, outfile, indent=1)
+    print("Wrote results to " + output)
+
+    if compare is not None:
+        with open(compare, 'r') as oldfile:
+            old = json.load(oldfile)
+        print("Time compared to " + compare + " (version " + str(old.get('version')) + "):")
+        compare_results(results, old['results'])
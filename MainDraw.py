@@ -1,9 +1,22 @@
 #!/usr/bin/env python3
 # reads a LAMMPS dump file and writes a tex file containing a tikz picture of the first snapshot in the dump
 
+import io
+import os
 import sys
+import gzip
+import json
 import math
-import operator
+import time
+import shutil
+import hashlib
+import resource
+import mmap
+import struct
+import signal
+import subprocess
+import concurrent.futures
+from array import array
 
 #TODO scaling of picture
 
@@ -28,227 +41,1273 @@ class InvalidHeight(Exception):
 class InvalidWidth(Exception):
     pass
 
-if __name__ == '__main__':
-    if len(sys.argv) < 3:
-        raise NumberOfArgumentsError("\n ERROR: Wrong number of arguments.\n Usage: ./MainDraw.py lammps_file outputfile.tex arguments\n arguments are optional and can be:\n projection=[cabinet|isometric|dimetric]\n orientation=[xyz|zxy|yzx]\n png_export\n width=10\n height=10\n width and heigt have a default value of 10. the program keeps the aspect ratio, i.e. not both values are enforced but the more rigorous constraint determines the geometry of the output.")
-    lammpsfile = open(sys.argv[1], 'r')
-    outfile = open(sys.argv[2], 'w')
-
-    # default values of arguments
-    # used projection
-    projection = "cabinet" # "cabinet", "isometric", "dimetric"
-    # used orientation
-    orientation = "xyz" # "xyz", "zxy", "yzx"
-    # whether additionally a png shall be exported
-    pngexport = False
-    # geometry
-    target_width = 10
-    target_height = 10
-    for i in range(3,len(sys.argv)):
-        arg = sys.argv[i].split("=")
-        if arg[0] == "projection":
-            if arg[1] == "cabinet":
-                projection = arg[1]
-            elif arg[1] == "isometric":
-                projection = arg[1]
-            elif arg[1] == "dimetric":
-                projection = arg[1]
-            else:
-                raise UnknownProjection("\n ERROR: " + arg[1] + " is not an valid projection. Only use 'cabinet', 'isometric', or 'dimetric'")
-        elif arg[0] == "orientation":
-            if arg[1] == "xyz":
-                orientation = arg[1]
-            elif arg[1] == "zxy":
-                orientation = arg[1]
-            elif arg[1] == "yzx":
-                orientation = arg[1]
+class InvalidFrames(Exception):
+    pass
+
+class InvalidJobs(Exception):
+    pass
+
+class InvalidLayerSize(Exception):
+    pass
+
+class InvalidRegion(Exception):
+    pass
+
+class InvalidTypes(Exception):
+    pass
+
+class InvalidGrid(Exception):
+    pass
+
+class InvalidCacheSize(Exception):
+    pass
+
+class MissingModule(Exception):
+    pass
+
+class InvalidAtoms(Exception):
+    pass
+
+class InvalidFollow(Exception):
+    pass
+
+# number of bytes of the ATOMS block that are decoded at once
+ATOMS_CHUNK_SIZE = 1 << 22
+# number of values that are transformed at once by affine_transformed
+TRANSFORM_BLOCK_SIZE = 1 << 16
+
+class SnapshotHeader:
+    # number of atoms, simulation box and column layout of one snapshot
+    def __init__(self):
+        self.timestep = 0
+        self.number_atoms = 0
+        self.box = None # (xmin, xmax, ymin, ymax, zmin, zmax)
+        self.num_columns = 0
+        self.type_index = -1
+        self.x_index = -1
+        self.y_index = -1
+        self.z_index = -1
+        # 0 if scaled coordinates (xs, ys, zs) are used, 1 if not
+        self.x_coord_mode = -1
+        self.y_coord_mode = -1
+        self.z_coord_mode = -1
+        # number of chunks of the per-atom values of binary dumps
+        self.num_chunks = 0
+
+    # returns for x, y, and z the factor and offset that map the coordinates
+    # in the file to unscaled coordinates
+    def coordinate_transforms(self):
+        xmin, xmax, ymin, ymax, zmin, zmax = self.box
+        transforms = []
+        for mode, lo, hi in ((self.x_coord_mode, xmin, xmax), (self.y_coord_mode, ymin, ymax), (self.z_coord_mode, zmin, zmax)):
+            if mode == 0:
+                transforms.append((hi - lo, lo))
             else:
-                raise UnknownOrientation("\n ERROR: " + arg[1] + " is not an valid orientation. Only use 'xyz', 'zxy', or 'yzx'")
-        elif arg[0] == "png_export":
-            pngexport = True
-        elif arg[0] == "height":
-            try:
-                target_height = float(arg[1])
-            except:
-                raise InvalidHeight("\n ERROR: " + arg[1] + " is not an valid heigth.")
-            if target_height <= 0:
-                raise InvalidHeight( "\n ERROR: " + arg[1] + " is not an valid heigth.")
-        elif arg[0] == "width":
-            try:
-                target_width = float(arg[1])
-            except:
-                raise InvalidWidth("\n ERROR: " + arg[1] + " is not an valid width.")
-            if target_width <= 0:
-                raise InvalidWidth("\n ERROR: " + arg[1] + " is not an valid width.")
-        else:
-            raise UnknownArgument("\n ERROR: " + arg[0] + " is not an valid argument.")
+                transforms.append((1., 0.))
+        return transforms
 
-    print("Reading LAMMPS dump file ...")
-    # read time step; not used anywhere
-    lammpsfile.readline()
-    lammpsfile.readline()
+# reads the header of the snapshot that starts at the current position of
+# the mapped dump file; afterwards the position is the start of the ATOMS block
+def read_snapshot_header(mm):
+    header = SnapshotHeader()
+    tmp = mm.readline()
+    if tmp.startswith(b"ITEM: TIMESTEP") != True:
+        raise LammpsFileCorrupt("\n   ERROR: Snapshot does not start with time step")
+    header.timestep = int(mm.readline())
     # read number of particles to draw
-    tmp = lammpsfile.readline()
-    if tmp != 'ITEM: NUMBER OF ATOMS\n':
+    tmp = mm.readline()
+    if tmp != b'ITEM: NUMBER OF ATOMS\n':
         raise LammpsFileCorrupt("\n   ERROR: Number of atoms not in fourth line of LAMMPS dump file")
-    number_atoms = int(lammpsfile.readline())
-    print("Reading " +  str(number_atoms) + " atoms")
+    header.number_atoms = int(mm.readline())
     # read simulation box
-    tmp = lammpsfile.readline()
-    if tmp.startswith("ITEM: BOX BOUNDS") != True:
+    tmp = mm.readline()
+    if tmp.startswith(b"ITEM: BOX BOUNDS") != True:
         raise LammpsFileCorrupt("\n   ERROR: Cannot handle simulation domain LAMMPS file")
-    tmp = lammpsfile.readline().split()
-    xmin = float(tmp[0]) 
-    xmax = float(tmp[1])
-    tmp = lammpsfile.readline().split()
-    ymin = float(tmp[0])
-    ymax = float(tmp[1])
-    tmp = lammpsfile.readline().split()
-    zmin = float(tmp[0])
-    zmax = float(tmp[1])
+    box = []
+    for i in range(3):
+        tmp = mm.readline().split()
+        box.append(float(tmp[0]))
+        box.append(float(tmp[1]))
+    header.box = tuple(box)
     # read header of position section find where are the positions
-    header = lammpsfile.readline()
-    if header.startswith("ITEM: ATOMS") != True:
+    tmp = mm.readline().decode()
+    if tmp.startswith("ITEM: ATOMS") != True:
         raise LammpsFileCorrupt("\n   ERROR: Header of list of atoms not in expected position")
-    split_header = header.split()
-    x_coord_mode = -1
-    y_coord_mode = -1
-    z_coord_mode = -1
+    find_atom_columns(header, tmp.split()[2:]) # skip ITEM: ATOMS in header
+    return header
+
+# sets the number of columns of the ATOMS block and the columns of the type
+# and the position of the atoms from the names of the columns
+def find_atom_columns(header, names):
+    header.num_columns = len(names)
     try:
-        x_index = split_header.index('xs') - 2 # subtract 2 to correct ITEM: ATOMS in header
-        x_coord_mode = 0
+        header.x_index = names.index('xs')
+        header.x_coord_mode = 0
     except:
         pass
     try:
-        x_index = split_header.index('x') - 2
-        x_coord_mode = 1
+        header.x_index = names.index('x')
+        header.x_coord_mode = 1
     except:
         pass
     try:
-        y_index = split_header.index('ys') - 2
-        y_coord_mode = 0
+        header.y_index = names.index('ys')
+        header.y_coord_mode = 0
     except:
         pass
     try:
-        y_index = split_header.index('y') - 2
-        y_coord_mode = 1
+        header.y_index = names.index('y')
+        header.y_coord_mode = 1
     except:
         pass
     try:
-        z_index = split_header.index('zs') - 2
-        z_coord_mode = 0
+        header.z_index = names.index('zs')
+        header.z_coord_mode = 0
     except:
         pass
     try:
-        z_index = split_header.index('z') - 2
-        z_coord_mode = 1
+        header.z_index = names.index('z')
+        header.z_coord_mode = 1
     except:
         pass
-    if x_coord_mode == -1:
+    if header.x_coord_mode == -1:
         raise LammpsFileCorrupt("\n   ERROR: Could not find x position in file")
-    if y_coord_mode == -1:
+    if header.y_coord_mode == -1:
         raise LammpsFileCorrupt("\n   ERROR: Could not find y position in file")
-    if z_coord_mode == -1:
+    if header.z_coord_mode == -1:
         raise LammpsFileCorrupt("\n   ERROR: Could not find z position in file")
-
     try:
-        type_index = split_header.index('type') - 2
+        header.type_index = names.index('type')
     except:
         raise LammpsFileCorrupt("\n   ERROR: Could not find type of atom in file")
-    
-    # read atom positions and type
-    list_of_atoms = [];
-    for i in range(number_atoms):
-        tmp = lammpsfile.readline().split()
-        list_of_atoms.append( [int(tmp[type_index]), float(tmp[x_index]), float(tmp[y_index]), float(tmp[z_index])] )
-    lammpsfile.close()
 
+# functions called with the name and the data of progress events: 'stage'
+# after every profiled stage (in the process that ran it), 'frame' after every
+# drawn snapshot and 'compile' after every compiled document
+PROGRESS_HOOKS = []
+
+def add_progress_hook(hook):
+    PROGRESS_HOOKS.append(hook)
+
+def remove_progress_hook(hook):
+    PROGRESS_HOOKS.remove(hook)
+
+def notify_progress(event, data):
+    for hook in PROGRESS_HOOKS:
+        hook(event, data)
+
+# returns the peak resident memory of this process (or of its largest waited
+# for child process) in MB
+def peak_rss(who=resource.RUSAGE_SELF):
+    rss = resource.getrusage(who).ru_maxrss
+    if sys.platform == 'darwin':
+        return rss / (1 << 20)
+    return rss / (1 << 10)
+
+# names of the profiled stages in the order they run
+PROFILE_STAGES = ("header", "read", "correct", "grid", "select", "scale", "sort", "cull", "tex", "compile")
+
+class Profiler:
+    # records the wall time, the number of processed atoms and the peak memory
+    # of the stages of drawing one snapshot. a stage lasts from its begin to
+    # the next begin or end
+    def __init__(self, frame=None, enabled=True):
+        self.frame = frame
+        self.enabled = enabled
+        self.records = []
+        self.current = None
+
+    def begin(self, stage, atoms=None):
+        if not self.enabled:
+            return
+        self.end()
+        self.current = (stage, atoms, time.perf_counter())
+
+    # ends the current stage; atoms replaces the number of atoms given to begin
+    def end(self, atoms=None):
+        if self.current is None:
+            return
+        stage, stage_atoms, start = self.current
+        self.current = None
+        if atoms is not None:
+            stage_atoms = atoms
+        seconds = time.perf_counter() - start
+        record = {
+            'frame': self.frame,
+            'stage': stage,
+            'seconds': seconds,
+            'atoms': stage_atoms,
+            'atoms_per_second': stage_atoms / seconds if stage_atoms is not None and seconds > 0 else None,
+            'peak_rss_mb': peak_rss(),
+        }
+        self.records.append(record)
+        notify_progress('stage', record)
+
+# profiler of runs without profile option
+NO_PROFILER = Profiler(enabled=False)
+
+# prints the time, throughput and peak memory of every stage summed over all
+# records and writes them together with the records to the JSON file filename
+def write_profile_report(records, filename):
+    stages = {}
+    for record in records:
+        stage = stages.setdefault(record['stage'], {'count': 0, 'seconds': 0., 'atoms': 0, 'peak_rss_mb': 0.})
+        stage['count'] += 1
+        stage['seconds'] += record['seconds']
+        stage['atoms'] += record['atoms'] or 0
+        stage['peak_rss_mb'] = max(stage['peak_rss_mb'], record['peak_rss_mb'])
+    for stage in stages.values():
+        stage['atoms_per_second'] = stage['atoms'] / stage['seconds'] if stage['atoms'] > 0 and stage['seconds'] > 0 else None
+    names = [name for name in PROFILE_STAGES if name in stages] + sorted(name for name in stages if name not in PROFILE_STAGES)
+    total = sum(stage['seconds'] for stage in stages.values())
+    print("Profile:")
+    print("  %-8s %6s %12s %7s %14s %12s" % ("stage", "runs", "seconds", "share", "atoms/s", "peak MB"))
+    for name in names:
+        stage = stages[name]
+        print("  %-8s %6d %12.3f %6.1f%% %14s %12.1f" % (name, stage['count'], stage['seconds'], 100. * stage['seconds'] / total if total > 0 else 0.,
+                                                        '%.0f' % stage['atoms_per_second'] if stage['atoms_per_second'] is not None else '-', stage['peak_rss_mb']))
+    with open(filename, 'w') as reportfile:
+        json.dump({'stages': stages, 'records': records}, reportfile, indent=1)
+    print("Wrote profile to " + filename)
+
+# returns the chunk of at most max_lines whole lines (and about
+# ATOMS_CHUNK_SIZE bytes) that starts at the current position of the mapped
+# dump file or text dump stream, and its number of lines. afterwards the
+# position is the end of the chunk
+def read_line_chunk(mm, max_lines):
+    if isinstance(mm, TextDumpStream):
+        return mm.read_lines(max_lines)
+    pos = mm.tell()
+    size = mm.size()
+    if pos >= size:
+        raise LammpsFileCorrupt("\n   ERROR: LAMMPS dump file ends within list of atoms")
+    end = min(pos + ATOMS_CHUNK_SIZE, size)
+    if end < size:
+        # only decode whole lines
+        cut = mm.rfind(b'\n', pos, end)
+        if cut == -1:
+            cut = mm.find(b'\n', end)
+        end = size if cut == -1 else cut + 1
+    chunk = mm[pos:end]
+    nlines = chunk.count(b'\n')
+    if end == size and not chunk.endswith(b'\n'):
+        nlines += 1
+    if nlines > max_lines:
+        # chunk reaches into the next snapshot
+        chunk = chunk[:nth_line_end(chunk, max_lines)]
+        nlines = max_lines
+    mm.seek(pos + len(chunk))
+    return chunk, nlines
+
+# returns the offset after the n-th newline of chunk
+def nth_line_end(chunk, n):
+    cut = -1
+    for i in range(n):
+        cut = chunk.find(b'\n', cut + 1)
+    return cut + 1
+
+# decodes the type, x, y, and z columns of the ATOMS block that starts at the
+# current position of the mapped dump file (or text dump stream) into typed
+# arrays. the block is split into chunks of whole lines, so no per-line or
+# per-atom python objects are kept. if a selection is given, only the atoms
+# selected by it are kept. afterwards the position is the end of the ATOMS block
+def read_atoms(mm, header, selection=None):
+    types = array('i')
+    xs = array('d')
+    ys = array('d')
+    zs = array('d')
+    ncols = header.num_columns
+    remaining = header.number_atoms
+    while remaining > 0:
+        chunk, nlines = read_line_chunk(mm, remaining)
+        tokens = chunk.split()
+        if len(tokens) != nlines * ncols:
+            raise LammpsFileCorrupt("\n   ERROR: Wrong number of columns in list of atoms")
+        if selection is None:
+            types.extend(map(int, tokens[header.type_index::ncols]))
+            xs.extend(map(float, tokens[header.x_index::ncols]))
+            ys.extend(map(float, tokens[header.y_index::ncols]))
+            zs.extend(map(float, tokens[header.z_index::ncols]))
+        else:
+            chunk_columns = (array('i', map(int, tokens[header.type_index::ncols])),
+                             array('d', map(float, tokens[header.x_index::ncols])),
+                             array('d', map(float, tokens[header.y_index::ncols])),
+                             array('d', map(float, tokens[header.z_index::ncols])))
+            for column, selected in zip((types, xs, ys, zs), selection.apply(*chunk_columns, transforms=header.coordinate_transforms())):
+                column.extend(selected)
+            del chunk_columns
+        del tokens
+        remaining -= nlines
+    return types, xs, ys, zs
+
+# returns a new array of factor * v + offset for every value v of column,
+# computed block by block; column is left unchanged
+def affine_transformed(column, factor, offset):
+    result = array('d')
+    for start in range(0, len(column), TRANSFORM_BLOCK_SIZE):
+        result.extend([factor * v + offset for v in column[start:start + TRANSFORM_BLOCK_SIZE]])
+    return result
+
+# compressed and binary dump files can not be mapped; they are read front to
+# back as a stream of their (decompressed) content
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+# returns a binary file object of the content of the dump file filename and
+# the opened file; gzip and zstd compressed dumps are decompressed while they
+# are read
+def open_dump_file(filename):
+    lammpsfile = open(filename, 'rb')
+    magic = lammpsfile.peek(4)[:4]
+    if magic.startswith(GZIP_MAGIC):
+        return gzip.GzipFile(fileobj=lammpsfile, mode='rb'), lammpsfile
+    if magic == ZSTD_MAGIC:
+        try:
+            from compression import zstd # python 3.14
+            return zstd.ZstdFile(lammpsfile, mode='rb'), lammpsfile
+        except ImportError:
+            pass
+        try:
+            import zstandard
+        except ImportError:
+            lammpsfile.close()
+            raise MissingModule("\n ERROR: Reading zstd compressed dump files needs the zstandard module (pip install zstandard)")
+        # dumps appended to hold several zstd frames
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(lammpsfile, read_across_frames=True)), lammpsfile
+    return lammpsfile, lammpsfile
+
+# number of bytes at the start of the content of a dump file from which its
+# format is recognized
+DUMP_FORMAT_BYTES = 128
+
+# whether start is the start of a binary dump: newer binary dumps start with
+# the negative length of a magic string like DUMPCUSTOM, older ones with a
+# time step, the number of atoms, the triclinic flag and boundary conditions
+def is_binary_dump_start(start):
+    if len(start) < 8:
+        return False
+    timestep, = struct.unpack('q', start[:8])
+    if timestep < 0:
+        return -timestep <= len(start) - 8 and start[8:8 - timestep].startswith(b'DUMP')
+    if len(start) < 44:
+        return False
+    number_atoms, triclinic = struct.unpack('qi', start[8:20])
+    boundary = struct.unpack('6i', start[20:44])
+    return number_atoms >= 0 and triclinic in (0, 1) and all(0 <= b <= 3 for b in boundary)
+
+# returns the format ('text' or 'binary') of the content of the dump file
+# filename; raises LammpsFileCorrupt if it is empty or no dump file
+def dump_format(filename):
+    fileobj, rawfile = open_dump_file(filename)
+    try:
+        start = fileobj.read(DUMP_FORMAT_BYTES)
+    finally:
+        fileobj.close()
+        rawfile.close()
+    if start.startswith(b'ITEM:'):
+        return 'text'
+    if is_binary_dump_start(start):
+        return 'binary'
+    if start == b'':
+        raise LammpsFileCorrupt("\n   ERROR: LAMMPS dump file is empty")
+    raise LammpsFileCorrupt("\n   ERROR: File is neither a LAMMPS text dump nor a LAMMPS binary dump")
+
+# whether filename is an uncompressed text dump, which is mapped instead of
+# streamed; raises LammpsFileCorrupt if it is no dump file
+def is_mapped_dump(filename):
+    with open(filename, 'rb') as lammpsfile:
+        if lammpsfile.read(5) == b'ITEM:':
+            return True
+    dump_format(filename)
+    return False
+
+# returns a TextDumpStream or a BinaryDumpStream of the dump file filename
+def open_dump_stream(filename):
+    binary = dump_format(filename) == 'binary'
+    fileobj, rawfile = open_dump_file(filename)
+    if binary:
+        return BinaryDumpStream(fileobj, rawfile)
+    return TextDumpStream(fileobj, rawfile)
+
+class DumpStream:
+    # dump file read front to back. tell is the position in the decompressed
+    # content
+    def __init__(self, fileobj, rawfile):
+        self.fileobj = fileobj
+        self.rawfile = rawfile
+        self.position = 0
+
+    def tell(self):
+        return self.position
+
+    def at_end(self):
+        return self.fileobj.peek(1) == b''
+
+    # returns the next n bytes; the stream must not end before them
+    def read_exactly(self, n):
+        data = self.fileobj.read(n)
+        if len(data) != n:
+            raise LammpsFileCorrupt("\n   ERROR: LAMMPS dump file ends within snapshot")
+        self.position += n
+        return data
+
+    def close(self):
+        self.fileobj.close()
+        self.rawfile.close()
+
+class TextDumpStream(DumpStream):
+    # text dump read front to back. offers the readline of the mapped dump
+    # file and the chunks of whole lines of the ATOMS block read by
+    # read_line_chunk. lines read beyond a chunk are kept in buffer
+    def __init__(self, fileobj, rawfile):
+        DumpStream.__init__(self, fileobj, rawfile)
+        self.buffer = b''
+        self.offset = 0
+
+    def at_end(self):
+        return self.offset == len(self.buffer) and DumpStream.at_end(self)
+
+    def readline(self):
+        if self.offset < len(self.buffer):
+            # the buffer holds whole lines
+            cut = self.buffer.find(b'\n', self.offset)
+            end = len(self.buffer) if cut == -1 else cut + 1
+            line = self.buffer[self.offset:end]
+            self.offset = end
+        else:
+            line = self.fileobj.readline()
+        self.position += len(line)
+        return line
+
+    def read_lines(self, max_lines):
+        if self.offset < len(self.buffer):
+            chunk = self.buffer[self.offset:]
+        else:
+            chunk = self.fileobj.read(ATOMS_CHUNK_SIZE)
+            if chunk == b'':
+                raise LammpsFileCorrupt("\n   ERROR: LAMMPS dump file ends within list of atoms")
+            if not chunk.endswith(b'\n'):
+                # only decode whole lines
+                chunk += self.fileobj.readline()
+        self.buffer = b''
+        self.offset = 0
+        nlines = chunk.count(b'\n')
+        if not chunk.endswith(b'\n'):
+            nlines += 1
+        if nlines > max_lines:
+            # chunk reaches into the next snapshot
+            end = nth_line_end(chunk, max_lines)
+            self.buffer = chunk
+            self.offset = end
+            chunk = chunk[:end]
+            nlines = max_lines
+        self.position += len(chunk)
+        return chunk, nlines
+
+# binary dumps (dump ... custom/binary or a dump file ending in .bin) store
+# every snapshot as a header of native integers and doubles followed by
+# chunks of the per-atom values as doubles
+class BinaryDumpStream(DumpStream):
+    pass
+
+# number of the byte order mark of binary dumps written on this machine
+BINARY_ENDIAN = 0x0001
+
+# reads the header of the snapshot that starts at the current position of the
+# binary dump stream; afterwards the position is the start of the per-atom values
+def read_binary_snapshot_header(stream):
+    header = SnapshotHeader()
+    timestep, = struct.unpack('q', stream.read_exactly(8))
+    revision = None
+    if timestep < 0:
+        # newer dumps start every snapshot with the negative length of a magic string
+        stream.read_exactly(-timestep)
+        endian, revision = struct.unpack('ii', stream.read_exactly(8))
+        if endian != BINARY_ENDIAN:
+            raise LammpsFileCorrupt("\n   ERROR: Binary LAMMPS dump file was written with another byte order")
+        timestep, = struct.unpack('q', stream.read_exactly(8))
+    header.timestep = timestep
+    header.number_atoms, triclinic = struct.unpack('qi', stream.read_exactly(12))
+    stream.read_exactly(6 * 4) # boundary conditions
+    header.box = struct.unpack('6d', stream.read_exactly(6 * 8))
+    if triclinic == 1:
+        stream.read_exactly(3 * 8) # tilt factors; the box holds the bounding box
+    elif triclinic != 0:
+        raise LammpsFileCorrupt("\n   ERROR: Cannot handle simulation domain LAMMPS file")
+    size_one, = struct.unpack('i', stream.read_exactly(4))
+    names = None
+    if revision is not None and revision > 1:
+        length, = struct.unpack('i', stream.read_exactly(4))
+        stream.read_exactly(length) # unit style
+        if stream.read_exactly(1) != b'\0':
+            stream.read_exactly(8) # time
+        length, = struct.unpack('i', stream.read_exactly(4))
+        names = stream.read_exactly(length).decode().split()
+    if names is None:
+        # older dumps do not name their columns; dump atom writes id type xs ys zs
+        if size_one != 5:
+            raise LammpsFileCorrupt("\n   ERROR: Binary LAMMPS dump file does not name its columns")
+        names = ['id', 'type', 'xs', 'ys', 'zs']
+    if len(names) != size_one:
+        raise LammpsFileCorrupt("\n   ERROR: Wrong number of columns in list of atoms")
+    find_atom_columns(header, names)
+    header.num_chunks, = struct.unpack('i', stream.read_exactly(4))
+    return header
+
+# decodes the type, x, y, and z columns of the per-atom values of a binary
+# dump stream into typed arrays without converting them to text. the values
+# are read in blocks of about ATOMS_CHUNK_SIZE bytes of whole atoms. if a
+# selection is given, only the atoms selected by it are kept. afterwards the
+# position is the end of the snapshot
+def read_binary_atoms(stream, header, selection=None):
+    types = array('i')
+    xs = array('d')
+    ys = array('d')
+    zs = array('d')
+    ncols = header.num_columns
+    block_size = max(1, ATOMS_CHUNK_SIZE // (8 * ncols)) * ncols
+    count = 0
+    for i in range(header.num_chunks):
+        n, = struct.unpack('i', stream.read_exactly(4))
+        if n % ncols != 0:
+            raise LammpsFileCorrupt("\n   ERROR: Wrong number of columns in list of atoms")
+        for start in range(0, n, block_size):
+            values = array('d')
+            values.frombytes(stream.read_exactly(8 * min(block_size, n - start)))
+            block_columns = (array('i', map(int, values[header.type_index::ncols])),
+                             values[header.x_index::ncols],
+                             values[header.y_index::ncols],
+                             values[header.z_index::ncols])
+            del values
+            count += len(block_columns[0])
+            if selection is not None:
+                block_columns = selection.apply(*block_columns, transforms=header.coordinate_transforms())
+            for column, block_column in zip((types, xs, ys, zs), block_columns):
+                column.extend(block_column)
+            del block_columns
+    if count != header.number_atoms:
+        raise LammpsFileCorrupt("\n   ERROR: Wrong number of atoms in list of atoms")
+    return types, xs, ys, zs
+
+# moves the dump stream over the snapshot at its current position without
+# decoding its atoms
+def skip_snapshot(stream):
+    if isinstance(stream, BinaryDumpStream):
+        header = read_binary_snapshot_header(stream)
+        for i in range(header.num_chunks):
+            n, = struct.unpack('i', stream.read_exactly(4))
+            stream.read_exactly(8 * n)
+    else:
+        header = read_snapshot_header(stream)
+        remaining = header.number_atoms
+        while remaining > 0:
+            chunk, nlines = read_line_chunk(stream, remaining)
+            remaining -= nlines
+
+class AtomSelection:
+    # atoms to draw given by a region and a set of types
+    def __init__(self):
+        # None, ('block', xlo, xhi, ylo, yhi, zlo, zhi) or ('sphere', x, y, z, radius)
+        self.region = None
+        # None or set of the types to draw
+        self.types = None
+
+    def selects_all(self):
+        return self.region is None and self.types is None
+
+    # returns the columns of the selected atoms. transforms holds for x, y, and
+    # z the factor and offset which map the given to unscaled coordinates
+    def apply(self, types, xs, ys, zs, transforms=((1., 0.), (1., 0.), (1., 0.))):
+        keep = range(len(types))
+        if self.types is not None:
+            keep = [i for i in keep if types[i] in self.types]
+        if self.region is not None and self.region[0] == 'block':
+            # a block is a block in scaled coordinates as well
+            bounds = []
+            for (factor, offset), lo, hi in zip(transforms, self.region[1::2], self.region[2::2]):
+                bounds.append((lo - offset) / factor)
+                bounds.append((hi - offset) / factor)
+            xlo, xhi, ylo, yhi, zlo, zhi = bounds
+            keep = [i for i in keep if xlo <= xs[i] <= xhi and ylo <= ys[i] <= yhi and zlo <= zs[i] <= zhi]
+        elif self.region is not None and self.region[0] == 'sphere':
+            cx, cy, cz, radius = self.region[1:]
+            (fx, ox), (fy, oy), (fz, oz) = transforms
+            r2 = radius * radius
+            keep = [i for i in keep if (fx * xs[i] + ox - cx) ** 2 + (fy * ys[i] + oy - cy) ** 2 + (fz * zs[i] + oz - cz) ** 2 <= r2]
+        if keep == range(len(types)):
+            return types, xs, ys, zs
+        return tuple(array(column.typecode, [column[i] for i in keep]) for column in (types, xs, ys, zs))
+
+    # returns the part of the simulation box that is drawn
+    def clip_box(self, box):
+        if self.region is None:
+            return box
+        if self.region[0] == 'block':
+            bounds = self.region[1:]
+        else:
+            cx, cy, cz, radius = self.region[1:]
+            bounds = (cx - radius, cx + radius, cy - radius, cy + radius, cz - radius, cz + radius)
+        clipped = []
+        for lo, hi, box_lo, box_hi in zip(bounds[0::2], bounds[1::2], box[0::2], box[1::2]):
+            if max(lo, box_lo) < min(hi, box_hi):
+                lo, hi = max(lo, box_lo), min(hi, box_hi)
+            elif math.isinf(lo) or math.isinf(hi):
+                lo, hi = box_lo, box_hi
+            clipped.append(lo)
+            clipped.append(hi)
+        return tuple(clipped)
+
+# parses region=block,xlo,xhi,ylo,yhi,zlo,zhi or region=sphere,x,y,z,radius;
+# bounds of a block can be INF
+def parse_region(value):
+    parts = value.split(',')
+    try:
+        numbers = tuple(float(p) for p in parts[1:])
+    except ValueError:
+        raise InvalidRegion("\n ERROR: " + value + " is not an valid region.")
+    if parts[0] == 'block' and len(numbers) == 6 and all(lo <= hi for lo, hi in zip(numbers[0::2], numbers[1::2])):
+        return ('block',) + numbers
+    if parts[0] == 'sphere' and len(numbers) == 4 and numbers[3] > 0 and not any(math.isinf(n) for n in numbers):
+        return ('sphere',) + numbers
+    raise InvalidRegion("\n ERROR: " + value + " is not an valid region. Only use 'block,xlo,xhi,ylo,yhi,zlo,zhi' or 'sphere,x,y,z,radius'")
+
+# parses types=1,3,...
+def parse_types(value):
+    try:
+        return set(int(t) for t in value.split(','))
+    except ValueError:
+        raise InvalidTypes("\n ERROR: " + value + " is not an valid list of types.")
+
+class DrawOptions:
+    # options given on the command line
+    def __init__(self):
+        # used projection
+        self.projection = "cabinet" # "cabinet", "isometric", "dimetric"
+        # used orientation
+        self.orientation = "xyz" # "xyz", "zxy", "yzx"
+        # whether additionally a png shall be exported
+        self.pngexport = False
+        # geometry
+        self.target_width = 10
+        self.target_height = 10
+        # slice of snapshots to draw; None draws only the first snapshot
+        self.frames = None
+        # whether the written documents are compiled with pdflatex
+        self.compile = False
+        # number of worker processes for drawing and compiling
+        self.jobs = 1
+        # whether atoms hidden behind other atoms are left out
+        self.cull = False
+        # whether every atom places a ball prepared once per type instead of
+        # shading its own ball
+        self.compact = False
+        # maximal number of atoms per separately compiled layer; None draws
+        # all atoms in one picture
+        self.layer_size = None
+        # atoms to draw
+        self.selection = AtomSelection()
+        # number of cells per direction of the spatial index of a snapshot;
+        # None does not use an index
+        self.grid = None
+        # directory of the render cache; None does not use a cache
+        self.cache = None
+        # maximal size of the render cache in bytes
+        self.cache_size = 1 << 30
+        # file of the profile report; "" writes it next to the output and None
+        # does not profile
+        self.profile = None
+        # seconds without a new snapshot after which following the dump file
+        # stops (math.inf follows until ctrl-c); None does not follow
+        self.follow = None
+
+# parses frames=start:stop:step (python slice semantics) or frames=n
+def parse_frames(value):
+    try:
+        parts = [int(p) if p != '' else None for p in value.split(':')]
+    except ValueError:
+        raise InvalidFrames("\n ERROR: " + value + " is not an valid range of frames.")
+    if len(parts) == 1 and parts[0] is not None:
+        return slice(parts[0], parts[0] + 1 if parts[0] != -1 else None)
+    if len(parts) > 3 or (len(parts) == 3 and parts[2] is not None and parts[2] <= 0):
+        raise InvalidFrames("\n ERROR: " + value + " is not an valid range of frames.")
+    return slice(*parts)
+
+def parse_arguments(args):
+    options = DrawOptions()
+    for i in range(len(args)):
+        arg = args[i].split("=")
+        if arg[0] == "projection":
+            if arg[1] in AXIS_VECTORS:
+                options.projection = arg[1]
+            else:
+                raise UnknownProjectionMode("\n ERROR: " + arg[1] + " is not an valid projection. Only use 'cabinet', 'isometric', or 'dimetric'")
+        elif arg[0] == "orientation":
+            if arg[1] in ORIENTATIONS:
+                options.orientation = arg[1]
+            else:
+                raise UnknownOrientation("\n ERROR: " + arg[1] + " is not an valid orientation. Only use 'xyz', 'zxy', or 'yzx'")
+        elif arg[0] == "png_export":
+            options.pngexport = True
+        elif arg[0] == "height":
+            try:
+                options.target_height = float(arg[1])
+            except:
+                raise InvalidHeight("\n ERROR: " + arg[1] + " is not an valid heigth.")
+            if options.target_height <= 0:
+                raise InvalidHeight( "\n ERROR: " + arg[1] + " is not an valid heigth.")
+        elif arg[0] == "width":
+            try:
+                options.target_width = float(arg[1])
+            except:
+                raise InvalidWidth("\n ERROR: " + arg[1] + " is not an valid width.")
+            if options.target_width <= 0:
+                raise InvalidWidth("\n ERROR: " + arg[1] + " is not an valid width.")
+        elif arg[0] == "frames":
+            options.frames = parse_frames(arg[1])
+        elif arg[0] == "cull":
+            options.cull = True
+        elif arg[0] == "compact":
+            options.compact = True
+        elif arg[0] == "region":
+            options.selection.region = parse_region(arg[1])
+        elif arg[0] == "types":
+            options.selection.types = parse_types(arg[1])
+        elif arg[0] == "grid":
+            try:
+                options.grid = int(arg[1])
+            except:
+                raise InvalidGrid("\n ERROR: " + arg[1] + " is not an valid number of grid cells.")
+            if options.grid <= 0:
+                raise InvalidGrid("\n ERROR: " + arg[1] + " is not an valid number of grid cells.")
+        elif arg[0] == "cache":
+            options.cache = arg[1]
+        elif arg[0] == "cache_size":
+            try:
+                options.cache_size = int(float(arg[1]) * (1 << 20))
+            except:
+                raise InvalidCacheSize("\n ERROR: " + arg[1] + " is not an valid cache size.")
+            if options.cache_size <= 0:
+                raise InvalidCacheSize("\n ERROR: " + arg[1] + " is not an valid cache size.")
+        elif arg[0] == "layer_size":
+            try:
+                options.layer_size = int(arg[1])
+            except:
+                raise InvalidLayerSize("\n ERROR: " + arg[1] + " is not an valid layer size.")
+            if options.layer_size <= 0:
+                raise InvalidLayerSize("\n ERROR: " + arg[1] + " is not an valid layer size.")
+        elif arg[0] == "compile":
+            options.compile = True
+        elif arg[0] == "follow":
+            if len(arg) == 1:
+                options.follow = math.inf
+            else:
+                try:
+                    options.follow = float(arg[1])
+                except:
+                    raise InvalidFollow("\n ERROR: " + arg[1] + " is not an valid number of seconds to follow.")
+                if options.follow <= 0:
+                    raise InvalidFollow("\n ERROR: " + arg[1] + " is not an valid number of seconds to follow.")
+        elif arg[0] == "profile":
+            options.profile = arg[1] if len(arg) > 1 else ""
+        elif arg[0] == "jobs":
+            try:
+                options.jobs = int(arg[1])
+            except:
+                raise InvalidJobs("\n ERROR: " + arg[1] + " is not an valid number of jobs.")
+            if options.jobs <= 0:
+                raise InvalidJobs("\n ERROR: " + arg[1] + " is not an valid number of jobs.")
+        else:
+            raise UnknownArgument("\n ERROR: " + arg[0] + " is not an valid argument.")
+    return options
+
+# index of the byte offsets of all snapshots in a dump file. the index is kept
+# in a sidecar file next to the dump, so that selecting a snapshot later is a
+# seek instead of a rescan of the whole file
+FRAME_INDEX_SUFFIX = '.frames'
+FRAME_INDEX_MAGIC = '# DrawLAMMPSwithTikz frame index'
+
+# returns the byte offsets of all ITEM: TIMESTEP lines of the mapped dump file
+# starting the search at offset start
+def scan_frame_offsets(mm, start=0):
+    offsets = array('q')
+    pos = mm.find(b'ITEM: TIMESTEP\n', start)
+    while pos != -1:
+        if pos == 0 or mm[pos - 1] == ord('\n'):
+            offsets.append(pos)
+        pos = mm.find(b'ITEM: TIMESTEP\n', pos + 1)
+    return offsets
+
+# returns the frame offsets of the dump file filename which is mapped by mm.
+# the sidecar index is reused if the dump did not change; if the dump only
+# grew, just the appended part is scanned
+def load_frame_index(filename, mm):
+    index_filename = filename + FRAME_INDEX_SUFFIX
+    size = mm.size()
+    mtime = os.stat(filename).st_mtime_ns
+    offsets = array('q')
+    indexed_size = 0
+    try:
+        with open(index_filename, 'r') as indexfile:
+            if indexfile.readline().rstrip('\n') != FRAME_INDEX_MAGIC:
+                raise ValueError
+            indexed_size, indexed_mtime = map(int, indexfile.readline().split())
+            offsets = array('q', map(int, indexfile.read().split()))
+        if indexed_size == size and indexed_mtime == mtime:
+            return offsets
+        # the dump has been rewritten if it shrank or the last indexed frame moved
+        if indexed_size > size or (len(offsets) > 0 and mm[offsets[-1]:offsets[-1] + 15] != b'ITEM: TIMESTEP\n'):
+            raise ValueError
+    except (OSError, ValueError):
+        offsets = array('q')
+        indexed_size = 0
+    # continue after the last indexed frame
+    start = 0
+    if len(offsets) > 0:
+        start = offsets[-1] + 1
+    offsets.extend(scan_frame_offsets(mm, start))
+    try:
+        with open(index_filename, 'w') as indexfile:
+            indexfile.write(FRAME_INDEX_MAGIC + '\n')
+            indexfile.write('%d %d\n' % (size, mtime))
+            indexfile.write('\n'.join(map(str, offsets)))
+            indexfile.write('\n')
+    except OSError:
+        print("Could not write frame index " + index_filename)
+    return offsets
+
+# inserts the number of the frame before the extension of filename
+def frame_filename(filename, frame):
+    root, dot, ext = filename.rpartition('.')
+    if dot == '' or '/' in ext:
+        return '%s_%05d' % (filename, frame)
+    return '%s_%05d.%s' % (root, frame, ext)
+
+# reads the snapshot starting at the current position of the mapped dump file
+# (or dump stream) and returns its header and the types and unscaled positions
+# of its atoms. if a selection is given, only the selected atoms are read and
+# the box of the header is clipped to the selected region
+def read_snapshot(mm, selection=None, profiler=NO_PROFILER):
+    binary = isinstance(mm, BinaryDumpStream)
+    profiler.begin('header')
+    header = read_binary_snapshot_header(mm) if binary else read_snapshot_header(mm)
+    print("Reading " +  str(header.number_atoms) + " atoms")
+    xmin, xmax, ymin, ymax, zmin, zmax = header.box
+    if selection is not None and selection.selects_all():
+        selection = None
+    # read atom positions and type
+    profiler.begin('read', header.number_atoms)
+    if binary:
+        types, xs, ys, zs = read_binary_atoms(mm, header, selection)
+    else:
+        types, xs, ys, zs = read_atoms(mm, header, selection)
     # correct coordinates if scaled coordinates are used in lammps file
-    if x_coord_mode == 0:
-        xdim = (xmax - xmin)
-        for i in range(number_atoms):
-            list_of_atoms[i][1] =  xdim * list_of_atoms[i][1] + xmin
-    if y_coord_mode == 0:
-        ydim = (ymax - ymin)
-        for i in range(number_atoms):
-            list_of_atoms[i][2] =  ydim * list_of_atoms[i][2] + ymin
-    if z_coord_mode == 0:
-        zdim = (zmax - zmin)
-        for i in range(number_atoms):
-            list_of_atoms[i][3] =  zdim * list_of_atoms[i][3] + zmin
+    profiler.begin('correct', len(types))
+    if header.x_coord_mode == 0:
+        xs = affine_transformed(xs, xmax - xmin, xmin)
+    if header.y_coord_mode == 0:
+        ys = affine_transformed(ys, ymax - ymin, ymin)
+    if header.z_coord_mode == 0:
+        zs = affine_transformed(zs, zmax - zmin, zmin)
+    profiler.end()
+    if selection is not None:
+        print("Selected " + str(len(types)) + " of " + str(header.number_atoms) + " atoms")
+        header.box = selection.clip_box(header.box)
+    return header, types, xs, ys, zs
+
+# spatial index of a snapshot: the atoms sorted into grid^3 cells of the box,
+# stored with unscaled positions next to the dump, so that drawing another
+# region of the snapshot only reads the cells overlapping the region
+GRID_INDEX_SUFFIX = '.grid'
+GRID_INDEX_MAGIC = b'# DrawLAMMPSwithTikz grid index\n'
+
+def grid_index_filename(dump_filename, offset, grid):
+    return os.path.join(dump_filename + GRID_INDEX_SUFFIX, '%d_%d.bin' % (offset, grid))
+
+# returns the range of cells along one direction of the box [lo, hi] divided
+# into grid cells that contain the coordinates from a to b
+def grid_cells(a, b, lo, hi, grid):
+    first = int(min(max((a - lo) / (hi - lo) * grid, 0), grid - 1))
+    last = int(min(max((b - lo) / (hi - lo) * grid, 0), grid - 1))
+    return first, last
+
+# returns the size and the modification time of the dump file filename, which
+# tie an index to the content of the dump
+def dump_stamp(filename):
+    stat = os.stat(filename)
+    return stat.st_size, stat.st_mtime_ns
+
+# writes the spatial index of the snapshot at offset with header and the given
+# unscaled atoms. stamp is the dump_stamp of the dump file
+def write_grid_index(filename, offset, header, grid, stamp, types, xs, ys, zs):
+    xmin, xmax, ymin, ymax, zmin, zmax = header.box
+    cells = array('q', (grid_cells(x, x, xmin, xmax, grid)[0] + grid * (grid_cells(y, y, ymin, ymax, grid)[0] + grid * grid_cells(z, z, zmin, zmax, grid)[0])
+                        for x, y, z in zip(xs, ys, zs)))
+    # counting sort of the atoms by cell
+    cell_start = array('q', bytes(8 * (grid ** 3 + 1)))
+    for c in cells:
+        cell_start[c + 1] += 1
+    for c in range(grid ** 3):
+        cell_start[c + 1] += cell_start[c]
+    position = cell_start[:-1]
+    order = array('q', bytes(8 * len(cells)))
+    for i, c in enumerate(cells):
+        order[position[c]] = i
+        position[c] += 1
+    del cells, position
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename + '.tmp', 'wb') as gridfile:
+        gridfile.write(GRID_INDEX_MAGIC)
+        gridfile.write(b'%d %d %d %d %d %d\n' % ((offset, header.timestep, header.number_atoms, grid) + stamp))
+        gridfile.write((' '.join(repr(b) for b in header.box) + '\n').encode())
+        cell_start.tofile(gridfile)
+        for column in (types, xs, ys, zs):
+            array(column.typecode, [column[i] for i in order]).tofile(gridfile)
+    os.replace(filename + '.tmp', filename)
+
+# reads the atoms in the cells of the spatial index that overlap the region of
+# selection; returns None if there is no valid index for the snapshot, e.g.
+# because the dump file changed since the index was written (see dump_stamp)
+def read_grid_index(filename, offset, header, grid, stamp, selection):
+    try:
+        gridfile = open(filename, 'rb')
+    except OSError:
+        return None
+    with gridfile:
+        if gridfile.readline() != GRID_INDEX_MAGIC:
+            return None
+        if gridfile.readline() != b'%d %d %d %d %d %d\n' % ((offset, header.timestep, header.number_atoms, grid) + stamp):
+            return None
+        if tuple(float(b) for b in gridfile.readline().split()) != header.box:
+            return None
+        cell_start = array('q')
+        cell_start.fromfile(gridfile, grid ** 3 + 1)
+        data_start = gridfile.tell()
+        n = header.number_atoms
+        column_starts = (data_start, data_start + 4 * n, data_start + 12 * n, data_start + 20 * n)
+        xmin, xmax, ymin, ymax, zmin, zmax = header.box
+        bounds = selection.clip_box((-math.inf, math.inf) * 3)
+        ix = grid_cells(bounds[0], bounds[1], xmin, xmax, grid)
+        iy = grid_cells(bounds[2], bounds[3], ymin, ymax, grid)
+        iz = grid_cells(bounds[4], bounds[5], zmin, zmax, grid)
+        columns = (array('i'), array('d'), array('d'), array('d'))
+        for k in range(iz[0], iz[1] + 1):
+            for j in range(iy[0], iy[1] + 1):
+                # the cells of a row in x are stored one after another
+                first = cell_start[ix[0] + grid * (j + grid * k)]
+                last = cell_start[ix[1] + 1 + grid * (j + grid * k)]
+                if last == first:
+                    continue
+                for column, start in zip(columns, column_starts):
+                    gridfile.seek(start + column.itemsize * first)
+                    column.fromfile(gridfile, last - first)
+    return columns
+
+# reads the snapshot at offset of the dump file filename (mapped by mm) like
+# read_snapshot. with a region and a grid, the atoms are read from the spatial
+# index of the snapshot, which is built on first use
+def read_frame(dump_filename, mm, offset, options, profiler=NO_PROFILER):
+    mm.seek(offset)
+    selection = options.selection
+    if options.grid is None or selection.region is None:
+        return read_snapshot(mm, selection, profiler)
+    profiler.begin('header')
+    header = read_snapshot_header(mm)
+    filename = grid_index_filename(dump_filename, offset, options.grid)
+    stamp = dump_stamp(dump_filename)
+    profiler.begin('read')
+    columns = read_grid_index(filename, offset, header, options.grid, stamp, selection)
+    if columns is None:
+        profiler.end()
+        print("Building spatial index of " + str(header.number_atoms) + " atoms")
+        mm.seek(offset)
+        header, types, xs, ys, zs = read_snapshot(mm, None, profiler)
+        profiler.begin('grid', header.number_atoms)
+        write_grid_index(filename, offset, header, options.grid, stamp, types, xs, ys, zs)
+        columns = (types, xs, ys, zs)
+    else:
+        profiler.end(len(columns[0]))
+        print("Reading " + str(len(columns[0])) + " of " + str(header.number_atoms) + " atoms from spatial index")
+    profiler.begin('select', len(columns[0]))
+    types, xs, ys, zs = selection.apply(*columns)
+    profiler.end()
+    print("Selected " + str(len(types)) + " of " + str(header.number_atoms) + " atoms")
+    header.box = selection.clip_box(header.box)
+    return header, types, xs, ys, zs
+
+# vectors in cm on the paper of the three axes of a picture, in the order of the
+# axes given by the orientation (e.g. z, x, y for zxy)
+AXIS_VECTORS = {
+    "cabinet": ((1., 0.), (0., 1.), (.3536, -.3536)),
+    "isometric": ((.866, .5), (.866, -.5), (0., 1.)),
+    "dimetric": ((.3712, .3346), (.9925, -.1219), (0., 1.)),
+}
+ORIENTATIONS = ("xyz", "zxy", "yzx")
+
+class Projection:
+    # parallel projection of the simulation box onto the paper given by a 3x3
+    # matrix. the first two rows map a position to the paper coordinates u
+    # (to the right) and v (upwards) in cm. the third row is the view depth:
+    # it is perpendicular to both (so it is constant along the lines that are
+    # projected onto one point) and grows towards the viewer. the third axis
+    # of the orientation points towards the viewer, i.e. out of the paper for
+    # the cabinet projection and upwards for the other ones, which are seen
+    # from above
+    def __init__(self, projection, orientation):
+        self.projection = projection
+        self.orientation = orientation
+        vectors = dict(zip(orientation, AXIS_VECTORS[projection]))
+        u = tuple(vectors[axis][0] for axis in 'xyz')
+        v = tuple(vectors[axis][1] for axis in 'xyz')
+        depth = [u[1] * v[2] - u[2] * v[1], u[2] * v[0] - u[0] * v[2], u[0] * v[1] - u[1] * v[0]]
+        if depth['xyz'.index(orientation[2])] < 0:
+            depth = [-d for d in depth]
+        self.matrix = (u, v, tuple(depth))
+
+    # returns the i-th coordinate (0: u, 1: v, 2: depth) of all atoms
+    def apply(self, i, xs, ys, zs):
+        a, b, c = self.matrix[i]
+        return array('d', (a * x + b * y + c * z for x, y, z in zip(xs, ys, zs)))
+
+    # returns the paper coordinates (in cm) of all atoms
+    def project(self, xs, ys, zs):
+        return self.apply(0, xs, ys, zs), self.apply(1, xs, ys, zs)
+
+    # returns the indices of the atoms sorted back to front
+    def sort(self, xs, ys, zs):
+        depth = self.apply(2, xs, ys, zs)
+        return array('l', sorted(range(len(depth)), key=depth.__getitem__))
+
+    # returns the smallest and largest paper coordinates u and v of the given
+    # positions as umin, umax, vmin, vmax
+    def extent_on_paper(self, xs, ys, zs):
+        us = self.apply(0, xs, ys, zs)
+        vs = self.apply(1, xs, ys, zs)
+        return min(us), max(us), min(vs), max(vs)
+
+    # returns width and height of the projection of the box
+    def extent(self, box):
+        xmin, xmax, ymin, ymax, zmin, zmax = box
+        lengths = (xmax - xmin, ymax - ymin, zmax - zmin)
+        width = sum(abs(a) * l for a, l in zip(self.matrix[0], lengths))
+        height = sum(abs(a) * l for a, l in zip(self.matrix[1], lengths))
+        return width, height
+
+    # returns the axis options of the tikzpicture
+    def tikz_axes(self):
+        vectors = AXIS_VECTORS[self.projection]
+        return ', '.join('%s={(%gcm,%gcm)}' % (axis, u, v) for axis, (u, v) in zip(self.orientation, vectors))
+
+    # returns the edges of the box as pairs of corners; the first list holds
+    # the edges at the rearmost corner, which are hidden behind the atoms
+    def box_edges(self, box):
+        xmin, xmax, ymin, ymax, zmin, zmax = box
+        corners = [(x, y, z) for x in (xmin, xmax) for y in (ymin, ymax) for z in (zmin, zmax)]
+        depth = self.matrix[2]
+        back = min(corners, key=lambda p: sum(d * c for d, c in zip(depth, p)))
+        hidden = []
+        visible = []
+        for p in corners:
+            for q in corners:
+                # edges connect corners differing in exactly one coordinate
+                if p < q and sum(a != b for a, b in zip(p, q)) == 1:
+                    if p == back or q == back:
+                        hidden.append((p, q))
+                    else:
+                        visible.append((p, q))
+        return hidden, visible
+
+# cells per radius of the coverage grid used for culling and maximal number of
+# cells of the grid; for small atoms the cells get larger, which only culls less
+CULL_CELLS_PER_RADIUS = 3
+CULL_MAX_CELLS = 1 << 24
+
+# removes the atoms from order (which is sorted back to front) whose disc of
+# radius on the paper is completely covered by atoms in front of them. the
+# atoms are visited front to back and the cells of a coverage grid that lie
+# completely inside the disc of a visible atom are marked. an atom is hidden
+# if all cells touching its disc are marked, so no visible atom is removed
+def cull_hidden_atoms(order, us, vs, radius):
+    if len(order) == 0:
+        return order
+    umin = min(us) - radius
+    vmin = min(vs) - radius
+    extent = max(max(us) - umin, max(vs) - vmin) + radius
+    cell = radius / CULL_CELLS_PER_RADIUS
+    if (extent / cell) ** 2 > CULL_MAX_CELLS:
+        cell = extent / math.sqrt(CULL_MAX_CELLS)
+    width = int(extent / cell) + 2
+    grid = bytearray(width * width)
+    visible = array('l')
+    for i in reversed(order):
+        u = (us[i] - umin) / cell
+        v = (vs[i] - vmin) / cell
+        r = radius / cell
+        first_row = int(v - r)
+        last_row = int(v + r)
+        # test whether all cells touching the disc are covered
+        hidden = True
+        for row in range(first_row, last_row + 1):
+            dy = max(row - v, v - row - 1, 0.)
+            half = math.sqrt(max(r * r - dy * dy, 0.))
+            if 0 in grid[row * width + int(u - half):row * width + int(u + half) + 1]:
+                hidden = False
+                break
+        if hidden:
+            continue
+        visible.append(i)
+        # mark the cells which lie completely inside the disc
+        for row in range(first_row, last_row + 1):
+            dy = max(abs(row - v), abs(row + 1 - v))
+            if dy >= r:
+                continue
+            half = math.sqrt(r * r - dy * dy)
+            first = math.ceil(u - half)
+            last = math.floor(u + half)
+            if last > first:
+                grid[row * width + first:row * width + last] = b'\x01' * (last - first)
+    visible.reverse()
+    return visible
+
+# number of atoms which are formatted and written at once
+WRITE_BLOCK_SIZE = 1 << 14
+
+# writes one line per atom in order, formatted by fmt from type, x, y, and z
+def write_atoms(outfile, fmt, order, types, xs, ys, zs):
+    for start in range(0, len(order), WRITE_BLOCK_SIZE):
+        outfile.write(''.join([fmt % (types[i], xs[i], ys[i], zs[i]) for i in order[start:start + WRITE_BLOCK_SIZE]]))
+
+# writes the definitions of the colors of all types up to num_of_types
+def write_colors(outfile, num_of_types):
+    # TODO: different colors
+    for i in range(num_of_types):
+        outfile.write('\definecolor{color%d}{RGB}{77,230,230}\n' % (i+1))
+
+# for the compact output: shades one ball per type into a save box and defines
+# \atom{type}{x}{y}{z}, which places the ball of type at the position x, y, z.
+# externalized tells whether the document externalizes its pictures. lines
+# ending in a brace end with %, since in the body of a standalone layer every
+# space would be typeset and widen the layer
+def write_ball_definitions(outfile, present_types, radius, externalized=True):
+    if externalized:
+        outfile.write('\\tikzexternaldisable\n')
+    for t in present_types:
+        outfile.write('\\expandafter\\newsavebox\\csname atomball%d\\endcsname\n' % t)
+        outfile.write('\\expandafter\\sbox\\csname atomball%d\\endcsname{\\tikz\\shade[ball color=color%d] (0,0) circle[radius=%fcm];}%%\n' % (t, t, radius))
+    if externalized:
+        outfile.write('\\tikzexternalenable\n')
+    outfile.write('\\newcommand{\\atom}[4]{\\node[inner sep=0pt] at (xyz cs:x=#2,y=#3,z=#4) {\\expandafter\\usebox\\csname atomball#1\\endcsname};}%\n')
+
+# writes the atoms in order to the current tikzpicture
+def write_atom_lines(outfile, order, types, xs, ys, zs, radius, options):
+    if options.compact:
+        write_atoms(outfile, '  \\atom{%d}{%.4f}{%.4f}{%.4f}\n', order, types, xs, ys, zs)
+    else:
+        write_atoms(outfile, '  \\shade[ball color=color%%d] (xyz cs:x=%%f, y=%%f, z=%%f) circle[x={(1cm,0cm)},y={(0cm,1cm)},x radius=%f,y radius=%f];\n' % (radius, radius), order, types, xs, ys, zs)
+
+# writes content to filename unless the file already has this content, so that
+# unchanged files keep their modification time. returns whether it was written
+def write_if_changed(filename, content):
+    try:
+        with open(filename, 'r') as oldfile:
+            if oldfile.read() == content:
+                return False
+    except OSError:
+        pass
+    with open(filename, 'w') as newfile:
+        newfile.write(content)
+    return True
+
+# writes the atoms in order as a sequence of layers of at most layer_size atoms,
+# back to front. every layer is a document of its own whose picture has the
+# bounding box (umin, vmin, umax, vmax) in cm, so that the compiled layers can
+# be stacked. layers whose content did not change are not rewritten. returns
+# the list of layer documents with the files they depend on
+def write_layers(root, order, types, xs, ys, zs, radius, bounding_box, projection, options):
+    colors_filename = root + '_colors.tex'
+    present_types = sorted(set(types))
+    colors = io.StringIO()
+    write_colors(colors, present_types[-1] if len(present_types) > 0 else 0)
+    write_if_changed(colors_filename, colors.getvalue())
+    layers = []
+    rewritten = 0
+    for start in range(0, len(order), options.layer_size):
+        layer_filename = '%s_layer%04d.tex' % (root, len(layers))
+        layer = io.StringIO()
+        layer.write('\\documentclass[border=0pt]{standalone}\n')
+        layer.write('\\usepackage{tikz}\n')
+        layer.write('\\input{%s}\n' % os.path.basename(colors_filename))
+        layer.write('\\begin{document}\n')
+        layer_order = order[start:start + options.layer_size]
+        if options.compact:
+            write_ball_definitions(layer, sorted(set(types[i] for i in layer_order)), radius, False)
+        layer.write('\\begin{tikzpicture}[%s]\n' % projection.tikz_axes())
+        layer.write('  \\useasboundingbox (%fcm,%fcm) rectangle (%fcm,%fcm);\n' % bounding_box)
+        write_atom_lines(layer, layer_order, types, xs, ys, zs, radius, options)
+        layer.write('\\end{tikzpicture}\n')
+        layer.write('\\end{document}\n')
+        if write_if_changed(layer_filename, layer.getvalue()):
+            rewritten += 1
+        layers.append((layer_filename, [colors_filename]))
+    print("Wrote " + str(len(layers)) + " layers, " + str(rewritten) + " of them changed")
+    return layers
+
+# writes a tex document with a tikz picture of the atoms to outfile. returns
+# the layer documents (with the files they depend on) that have to be compiled
+# before the document itself. with a render cache, the drawing order is taken
+# from or stored in the cache under order_key
+def draw_snapshot(header, types, xs, ys, zs, outfile, options, cache=None, order_key=None, profiler=NO_PROFILER):
+    pngexport = options.pngexport
+    target_width = options.target_width
+    target_height = options.target_height
+    projection = Projection(options.projection, options.orientation)
 
     # scale picture
-    if projection == "cabinet": 
-        if orientation == "xyz":
-            # x={(1cm,0cm)}, y={(0cm,1cm)}, z={(3.536mm,-3.536mm)}]\n')
-            current_width = (xmax - xmin) + .3536 * (zmax - zmin)
-            current_height =  (ymax - ymin) + .3536 * (zmax - zmin)
-        elif orientation == "zxy":
-            current_width = (zmax - zmin) + .3536 * (ymax - ymin)
-            current_height =  (xmax - xmin) + .3536 * (ymax - ymin)
-        elif orientation == "yzx":
-            current_width = (ymax - ymin) + .3536 * (xmax - xmin)
-            current_height =  (zmax - zmin) + .3536 * (xmax - xmin)
-    elif projection == "isometric":
-        if orientation == "xyz":
-            current_width = .866 * (xmax - xmin) + .866 * (ymax - ymin)
-            current_height =  .5 * (xmax - xmin) + .5 * (ymax - ymin) + (zmax - zmin)
-        elif orientation == "zxy":
-            current_width = .866 * (xmax - xmin) + .866 * (ymax - ymin)
-            current_height =  .5 * (xmax - xmin) + .5 * (ymax - ymin) + (zmax - zmin)
-        elif orientation == "yzx":
-            current_width = .866 * (xmax - xmin) + .866 * (ymax - ymin)
-            current_height =  .5 * (xmax - xmin) + .5 * (ymax - ymin) + (zmax - zmin)
-    elif projection == "dimetric":
-        if orientation == "xyz":
-            current_width = .3712 * (xmax - xmin) + .9925 * (ymax - ymin)
-            current_height =  .3346 * (xmax - xmin) + .1219 * (ymax - ymin) + (zmax - zmin)
-        elif orientation == "zxy":
-            current_width = .3712 * (zmax - zmin) + .9925 * (xmax - xmin)
-            current_height =  .3346 * (zmax - zmin) + .1219 * (xmax - xmin) + (ymax - ymin)
-        elif orientation == "yzx":
-            current_width = .3712 * (ymax - ymin) + .9925 * (zmax - zmin)
-            current_height =  .3346 * (ymax - ymin) + .1219 * (zmax - zmin) + (xmax - xmin)
+    profiler.begin('scale', len(types))
+    current_width, current_height = projection.extent(header.box)
     scale = min(target_width / current_width, target_height / current_height)
-    xmin *= scale
-    xmax *= scale
-    ymin *= scale
-    ymax *= scale
-    zmin *= scale
-    zmax *= scale
-    for i in range(number_atoms):
-        list_of_atoms[i][1] *= scale
-        list_of_atoms[i][2] *= scale
-        list_of_atoms[i][3] *= scale
+    box = tuple(scale * c for c in header.box)
+    # the given positions stay unscaled, so the same atoms can be drawn again
+    xs = affine_transformed(xs, scale, 0.)
+    ys = affine_transformed(ys, scale, 0.)
+    zs = affine_transformed(zs, scale, 0.)
     radius = .8 * scale
-                
-    # sort list of atoms 
-    if projection == "cabinet": 
-        if orientation == "xyz":
-            # list_of_atoms.sort(key=operator.itemgetter(3,2,1)) # sort first x, then y, then z (maybe only z is enough)
-            list_of_atoms.sort(key=operator.itemgetter(3)) # sort in z
-        elif orientation == "zxy":
-            list_of_atoms.sort(key=operator.itemgetter(2)) # sort in y
-        elif orientation == "yzx":
-            list_of_atoms.sort(key=operator.itemgetter(1)) # sort in x
-    elif projection == "isometric":
-        if orientation == "xyz":
-            # list_of_atoms.sort(key=operator.itemgetter(3,2,1)) # sort first x, then y, then z (maybe only z is enough)
-            list_of_atoms.sort(key=lambda x: -x[1]+x[2])
-        elif orientation == "zxy":
-            list_of_atoms.sort(key=lambda x: -x[3]+x[1])
-        elif orientation == "yzx":
-            list_of_atoms.sort(key=lambda x: -x[2]+x[3])
-    elif projection == "dimetric":
-        if orientation == "xyz":
-            list_of_atoms.sort(key=lambda x: -x[1]+.182*x[2]) # maybe not completely correct
-        elif orientation == "zxy":
-            list_of_atoms.sort(key=lambda x: -x[3]+.182*x[1]) # maybe not completely correct
-        elif orientation == "yzx":
-            list_of_atoms.sort(key=lambda x: -x[2]+.182*x[3]) # maybe not completely correct
-
-    types = next(zip(*list_of_atoms)) # extract all types from list of atoms
-    num_of_types = len(set(types)) # set determines the unique elements of types and len is then number of different types
+
+    # sort atoms back to front; order holds the indices of the atoms in drawing order
+    profiler.begin('sort', len(types))
+    order = None
+    if cache is not None:
+        order = cache.load_order(order_key)
+    if order is None:
+        order = projection.sort(xs, ys, zs)
+        if options.cull:
+            profiler.begin('cull', len(order))
+            us, vs = projection.project(xs, ys, zs)
+            visible = cull_hidden_atoms(order, us, vs, radius)
+            print("Culled " + str(len(order) - len(visible)) + " of " + str(len(order)) + " atoms hidden behind other atoms")
+            order = visible
+            del us, vs
+        if cache is not None:
+            cache.store_order(order_key, order)
+
+    profiler.begin('tex', len(order))
+    present_types = sorted(set(types)) # set determines the unique elements of types
+    num_of_types = present_types[-1] if len(present_types) > 0 else 0 # colors are defined for all types up to the largest one
+
+    hidden_edges, visible_edges = projection.box_edges(box)
+    layers = []
+    if options.layer_size is not None:
+        # the layers share the bounding box of all atoms and the box
+        root = os.path.splitext(outfile.name)[0]
+        corners = [p for edge in hidden_edges + visible_edges for p in edge]
+        umin, umax, vmin, vmax = projection.extent_on_paper(*zip(*corners))
+        if len(order) > 0:
+            atoms_umin, atoms_umax, atoms_vmin, atoms_vmax = projection.extent_on_paper(xs, ys, zs)
+            umin = min(umin, atoms_umin - radius)
+            umax = max(umax, atoms_umax + radius)
+            vmin = min(vmin, atoms_vmin - radius)
+            vmax = max(vmax, atoms_vmax + radius)
+        bounding_box = (umin, vmin, umax, vmax)
+        layers = write_layers(root, order, types, xs, ys, zs, radius, bounding_box, projection, options)
     # output atoms
     outfile.write('\documentclass[a4paper]{article}\n')
     outfile.write('\n')
@@ -268,9 +1327,10 @@ if __name__ == '__main__':
     outfile.write('\n')
     outfile.write('\\usepackage{hyperref}\n')
     outfile.write('\n')
-    # TODO: different colors
-    for i in range(num_of_types):
-        outfile.write('\definecolor{color%d}{RGB}{77,230,230}\n' % (i+1))
+    if options.layer_size is None:
+        write_colors(outfile, num_of_types)
+    else:
+        outfile.write('\\input{%s}\n' % os.path.basename(root + '_colors.tex'))
     outfile.write('\n')
     outfile.write('\\tikzset{\n')
     outfile.write('    mylargerpadding/.style={\n')
@@ -298,76 +1358,754 @@ if __name__ == '__main__':
     outfile.write('\everymath{\displaystyle}\n')
     outfile.write('\\begin{document}\n')
     outfile.write('\\tiny\n')
-    outfile.write('\\tikzset{external/force remake}\n')
+    if options.cache is None:
+        outfile.write('\\tikzset{external/force remake}\n')
+    else:
+        # pictures are only externalized again if they changed
+        outfile.write('%\\tikzset{external/force remake}\n')
     outfile.write('\pgfplotsset{every axis plot/.append style={line width=1pt}}\n')
     outfile.write('\n')
-    #outfile.write('\\begin{tikzpicture}[mylargerpadding, x={(3.85mm,-3.85mm)}, z={(1cm,0cm)}]\n')
-    if orientation == "xyz":
-        if projection == "cabinet":
-            outfile.write('\\begin{tikzpicture}[mylargerpadding, x={(1cm,0cm)}, y={(0cm,1cm)}, z={(3.536mm,-3.536mm)}]\n')
-        elif projection == "isometric":
-            outfile.write('\\begin{tikzpicture}[mylargerpadding, x={(8.66mm,5mm)}, y={(8.66mm,-5mm)}, z={(0cm,1cm)}]\n')
-        elif projection == "dimetric":
-            outfile.write('\\begin{tikzpicture}[mylargerpadding, x={(3.712mm,3.346mm)}, y={(9.925mm,-1.219mm)}, z={(0cm,1cm)}]\n')
-        outfile.write('  \draw [dashed, semithick, darkgray] (xyz cs:x=%s,y=%s,z=%s) -- (xyz cs:x=%s,y=%s,z=%s);\n' % (xmin, ymin, zmin, xmax, ymin, zmin))
-        outfile.write('  \draw [dashed, semithick, darkgray] (xyz cs:x=%s,y=%s,z=%s) -- (xyz cs:x=%s,y=%s,z=%s);\n' % (xmax, ymin, zmin, xmax, ymin, zmax))
-        outfile.write('  \draw [dashed, semithick, darkgray] (xyz cs:x=%s,y=%s,z=%s) -- (xyz cs:x=%s,y=%s,z=%s);\n' % (xmax, ymin, zmin, xmax, ymax, zmin))
-        for i in range(number_atoms):
-            outfile.write('  \shade[ball color=color%d] (xyz cs:x=%f, y=%f, z=%f) circle[x={(1cm,0cm)},y={(0cm,1cm)},x radius=%f,y radius=%f];\n' % (list_of_atoms[i][0], list_of_atoms[i][1], list_of_atoms[i][2], list_of_atoms[i][3], radius, radius))
-        outfile.write('  \draw [semithick, darkgray] (xyz cs:x=%s,y=%s,z=%s) -- (xyz cs:x=%s,y=%s,z=%s);\n' % (xmin, ymin, zmin, xmin, ymin, zmax))
-        outfile.write('  \draw [semithick, darkgray] (xyz cs:x=%s,y=%s,z=%s) -- (xyz cs:x=%s,y=%s,z=%s);\n' % (xmin, ymin, zmin, xmin, ymax, zmin))
-        outfile.write('  \draw [semithick, darkgray] (xyz cs:x=%s,y=%s,z=%s) -- (xyz cs:x=%s,y=%s,z=%s);\n' % (xmin, ymin, zmax, xmin, ymax, zmax))
-        outfile.write('  \draw [semithick, darkgray] (xyz cs:x=%s,y=%s,z=%s) -- (xyz cs:x=%s,y=%s,z=%s);\n' % (xmin, ymin, zmax, xmax, ymin, zmax))
-        outfile.write('  \draw [semithick, darkgray] (xyz cs:x=%s,y=%s,z=%s) -- (xyz cs:x=%s,y=%s,z=%s);\n' % (xmin, ymax, zmin, xmin, ymax, zmax))
-        outfile.write('  \draw [semithick, darkgray] (xyz cs:x=%s,y=%s,z=%s) -- (xyz cs:x=%s,y=%s,z=%s);\n' % (xmin, ymax, zmin, xmax, ymax, zmin))
-        outfile.write('  \draw [semithick, darkgray] (xyz cs:x=%s,y=%s,z=%s) -- (xyz cs:x=%s,y=%s,z=%s);\n' % (xmin, ymax, zmax, xmax, ymax, zmax))
-        outfile.write('  \draw [semithick, darkgray] (xyz cs:x=%s,y=%s,z=%s) -- (xyz cs:x=%s,y=%s,z=%s);\n' % (xmax, ymin, zmax, xmax, ymax, zmax))
-        outfile.write('  \draw [semithick, darkgray] (xyz cs:x=%s,y=%s,z=%s) -- (xyz cs:x=%s,y=%s,z=%s);\n' % (xmax, ymax, zmin, xmax, ymax, zmax))
-    elif orientation == "zxy":
-        if projection == "cabinet":
-            outfile.write('\\begin{tikzpicture}[mylargerpadding, z={(1cm,0cm)}, x={(0cm,1cm)}, y={(3.536mm,-3.536mm)}]\n')
-        elif projection == "isometric":
-            outfile.write('\\begin{tikzpicture}[mylargerpadding, z={(8.66mm,5mm)}, x={(8.66mm,-5mm)}, y={(0cm,1cm)}]\n')
-        elif projection == "dimetric":
-            outfile.write('\\begin{tikzpicture}[mylargerpadding, z={(3.712mm,3.346mm)}, x={(9.925mm,-1.219mm)}, y={(0cm,1cm)}]\n')
-        outfile.write('  \draw [dashed, semithick, darkgray] (xyz cs:x=%s,y=%s,z=%s) -- (xyz cs:x=%s,y=%s,z=%s);\n' % (xmin, ymin, zmin, xmin, ymin, zmax))
-        outfile.write('  \draw [dashed, semithick, darkgray] (xyz cs:x=%s,y=%s,z=%s) -- (xyz cs:x=%s,y=%s,z=%s);\n' % (xmin, ymin, zmax, xmin, ymax, zmax))
-        outfile.write('  \draw [dashed, semithick, darkgray] (xyz cs:x=%s,y=%s,z=%s) -- (xyz cs:x=%s,y=%s,z=%s);\n' % (xmin, ymin, zmax, xmax, ymin, zmax))
-        for i in range(number_atoms):
-            outfile.write('  \shade[ball color=color%d] (xyz cs:x=%f, y=%f, z=%f) circle[x={(1cm,0cm)},y={(0cm,1cm)},x radius=%f,y radius=%f];\n' % (list_of_atoms[i][0], list_of_atoms[i][1], list_of_atoms[i][2], list_of_atoms[i][3], radius, radius))
-        outfile.write('  \draw [semithick, darkgray] (xyz cs:x=%s,y=%s,z=%s) -- (xyz cs:x=%s,y=%s,z=%s);\n' % (xmin, ymin, zmin, xmin, ymax, zmin))
-        outfile.write('  \draw [semithick, darkgray] (xyz cs:x=%s,y=%s,z=%s) -- (xyz cs:x=%s,y=%s,z=%s);\n' % (xmin, ymin, zmin, xmax, ymin, zmin))
-        outfile.write('  \draw [semithick, darkgray] (xyz cs:x=%s,y=%s,z=%s) -- (xyz cs:x=%s,y=%s,z=%s);\n' % (xmin, ymax, zmin, xmin, ymax, zmax))
-        outfile.write('  \draw [semithick, darkgray] (xyz cs:x=%s,y=%s,z=%s) -- (xyz cs:x=%s,y=%s,z=%s);\n' % (xmin, ymax, zmin, xmax, ymax, zmin))
-        outfile.write('  \draw [semithick, darkgray] (xyz cs:x=%s,y=%s,z=%s) -- (xyz cs:x=%s,y=%s,z=%s);\n' % (xmin, ymax, zmax, xmax, ymax, zmax))
-        outfile.write('  \draw [semithick, darkgray] (xyz cs:x=%s,y=%s,z=%s) -- (xyz cs:x=%s,y=%s,z=%s);\n' % (xmax, ymin, zmin, xmax, ymin, zmax))
-        outfile.write('  \draw [semithick, darkgray] (xyz cs:x=%s,y=%s,z=%s) -- (xyz cs:x=%s,y=%s,z=%s);\n' % (xmax, ymin, zmin, xmax, ymax, zmin))
-        outfile.write('  \draw [semithick, darkgray] (xyz cs:x=%s,y=%s,z=%s) -- (xyz cs:x=%s,y=%s,z=%s);\n' % (xmax, ymin, zmax, xmax, ymax, zmax))
-        outfile.write('  \draw [semithick, darkgray] (xyz cs:x=%s,y=%s,z=%s) -- (xyz cs:x=%s,y=%s,z=%s);\n' % (xmax, ymax, zmin, xmax, ymax, zmax))
-    elif orientation == "yzx":
-        if projection == "cabinet":
-            outfile.write('\\begin{tikzpicture}[mylargerpadding, y={(1cm,0cm)}, z={(0cm,1cm)}, x={(3.536mm,-3.536mm)}]\n')
-        elif projection == "isometric":
-            outfile.write('\\begin{tikzpicture}[mylargerpadding, y={(8.66mm,5mm)}, z={(8.66mm,-5mm)}, x={(0cm,1cm)}]\n')
-        elif projection == "dimetric":
-            outfile.write('\\begin{tikzpicture}[mylargerpadding, y={(3.712mm,3.346mm)}, z={(9.925mm,-1.219mm)}, x={(0cm,1cm)}]\n')
-        outfile.write('  \draw [dashed, semithick, darkgray] (xyz cs:x=%s,y=%s,z=%s) -- (xyz cs:x=%s,y=%s,z=%s);\n' % (xmin, ymin, zmin, xmin, ymax, zmin))
-        outfile.write('  \draw [dashed, semithick, darkgray] (xyz cs:x=%s,y=%s,z=%s) -- (xyz cs:x=%s,y=%s,z=%s);\n' % (xmin, ymax, zmin, xmin, ymax, zmax))
-        outfile.write('  \draw [dashed, semithick, darkgray] (xyz cs:x=%s,y=%s,z=%s) -- (xyz cs:x=%s,y=%s,z=%s);\n' % (xmin, ymax, zmin, xmax, ymax, zmin))
-        for i in range(number_atoms):
-            outfile.write('  \shade[ball color=color%d] (xyz cs:x=%f, y=%f, z=%f) circle[x={(1cm,0cm)},y={(0cm,1cm)},x radius=%f,y radius=%f];\n' % (list_of_atoms[i][0], list_of_atoms[i][1], list_of_atoms[i][2], list_of_atoms[i][3], radius, radius))
-        outfile.write('  \draw [semithick, darkgray] (xyz cs:x=%s,y=%s,z=%s) -- (xyz cs:x=%s,y=%s,z=%s);\n' % (xmin, ymin, zmin, xmin, ymin, zmax))
-        outfile.write('  \draw [semithick, darkgray] (xyz cs:x=%s,y=%s,z=%s) -- (xyz cs:x=%s,y=%s,z=%s);\n' % (xmin, ymin, zmin, xmax, ymin, zmin))
-        outfile.write('  \draw [semithick, darkgray] (xyz cs:x=%s,y=%s,z=%s) -- (xyz cs:x=%s,y=%s,z=%s);\n' % (xmin, ymin, zmax, xmin, ymax, zmax))
-        outfile.write('  \draw [semithick, darkgray] (xyz cs:x=%s,y=%s,z=%s) -- (xyz cs:x=%s,y=%s,z=%s);\n' % (xmin, ymin, zmax, xmax, ymin, zmax))
-        outfile.write('  \draw [semithick, darkgray] (xyz cs:x=%s,y=%s,z=%s) -- (xyz cs:x=%s,y=%s,z=%s);\n' % (xmin, ymax, zmax, xmax, ymax, zmax))
-        outfile.write('  \draw [semithick, darkgray] (xyz cs:x=%s,y=%s,z=%s) -- (xyz cs:x=%s,y=%s,z=%s);\n' % (xmax, ymin, zmin, xmax, ymin, zmax))
-        outfile.write('  \draw [semithick, darkgray] (xyz cs:x=%s,y=%s,z=%s) -- (xyz cs:x=%s,y=%s,z=%s);\n' % (xmax, ymin, zmin, xmax, ymax, zmin))
-        outfile.write('  \draw [semithick, darkgray] (xyz cs:x=%s,y=%s,z=%s) -- (xyz cs:x=%s,y=%s,z=%s);\n' % (xmax, ymin, zmax, xmax, ymax, zmax))
-        outfile.write('  \draw [semithick, darkgray] (xyz cs:x=%s,y=%s,z=%s) -- (xyz cs:x=%s,y=%s,z=%s);\n' % (xmax, ymax, zmin, xmax, ymax, zmax))
+    if options.compact and options.layer_size is None:
+        # shade one ball per type and place it at the position of every atom
+        write_ball_definitions(outfile, present_types, radius)
+        outfile.write('\n')
+    outfile.write('\\begin{tikzpicture}[mylargerpadding, %s]\n' % projection.tikz_axes())
+    for p, q in hidden_edges:
+        outfile.write('  \draw [dashed, semithick, darkgray] (xyz cs:x=%s,y=%s,z=%s) -- (xyz cs:x=%s,y=%s,z=%s);\n' % (p + q))
+    if options.layer_size is None:
+        write_atom_lines(outfile, order, types, xs, ys, zs, radius, options)
+    else:
+        # stack the compiled layers back to front
+        for layer_filename, dependencies in layers:
+            outfile.write('  \\node[inner sep=0pt, anchor=south west] at (%fcm,%fcm) {\\includegraphics{%s}};\n' % (bounding_box[0], bounding_box[1], os.path.splitext(os.path.basename(layer_filename))[0]))
+    for p, q in visible_edges:
+        outfile.write('  \draw [semithick, darkgray] (xyz cs:x=%s,y=%s,z=%s) -- (xyz cs:x=%s,y=%s,z=%s);\n' % (p + q))
 
     outfile.write('\end{tikzpicture}\n')
     outfile.write('\n')
     outfile.write('\n')
     outfile.write('\end{document}\n')
-    outfile.close()
+    profiler.end()
+    return layers
+
+# cache of the results of the stages of drawing a snapshot. every entry is
+# stored under a hash of everything its content depends on: the bytes of the
+# snapshot, the options used by the stage, and the version of the cache. the
+# least recently used entries are removed if the cache gets larger than its
+# maximal size
+CACHE_VERSION = 1
+
+class RenderCache:
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+
+    # returns the key of an entry depending on parts
+    def key(self, *parts):
+        return hashlib.sha256(repr((CACHE_VERSION,) + parts).encode()).hexdigest()
+
+    def path(self, key, kind):
+        return os.path.join(self.directory, key + '.' + kind)
+
+    # returns the path of the entry, which is marked as recently used, or None
+    def get(self, key, kind):
+        path = self.path(key, kind)
+        try:
+            os.utime(path)
+        except OSError:
+            return None
+        return path
+
+    # stores data (bytes) as entry; the entry appears at once, so that
+    # concurrent jobs never see a partial entry
+    def put(self, key, kind, data):
+        path = self.path(key, kind)
+        with open(path + '.%d.tmp' % os.getpid(), 'wb') as entry:
+            entry.write(data)
+        os.replace(path + '.%d.tmp' % os.getpid(), path)
+
+    def put_file(self, key, kind, filename):
+        path = self.path(key, kind)
+        shutil.copyfile(filename, path + '.%d.tmp' % os.getpid())
+        os.replace(path + '.%d.tmp' % os.getpid(), path)
+
+    # parsed snapshots: header and unscaled atoms
+    def load_snapshot(self, key):
+        path = self.get(key, 'atoms')
+        if path is None:
+            return None
+        with open(path, 'rb') as entry:
+            fields = json.loads(entry.readline())
+            header = SnapshotHeader()
+            header.timestep = fields['timestep']
+            header.number_atoms = fields['number_atoms']
+            header.box = tuple(fields['box'])
+            columns = (array('i'), array('d'), array('d'), array('d'))
+            for column in columns:
+                column.fromfile(entry, fields['n'])
+        return (header,) + columns
+
+    def store_snapshot(self, key, header, types, xs, ys, zs):
+        fields = {'timestep': header.timestep, 'number_atoms': header.number_atoms, 'box': header.box, 'n': len(types)}
+        self.put(key, 'atoms', json.dumps(fields).encode() + b'\n' + b''.join(column.tobytes() for column in (types, xs, ys, zs)))
+
+    # drawing orders of the atoms
+    def load_order(self, key):
+        path = self.get(key, 'order')
+        if path is None:
+            return None
+        order = array('l')
+        with open(path, 'rb') as entry:
+            order.frombytes(entry.read())
+        return order
+
+    def store_order(self, key, order):
+        self.put(key, 'order', array('l', order).tobytes())
+
+    # compiled documents: the pdf of the document and the externalized pictures,
+    # stored under a hash of the document and the files it depends on
+    def compile_key(self, tex_filename, dependencies):
+        digest = hashlib.sha256()
+        for filename in [tex_filename] + sorted(dependencies):
+            with open(filename, 'rb') as source:
+                digest.update(source.read())
+        return self.key('compiled', COMPILE_COMMAND, digest.hexdigest())
+
+    # copies the cached results of the compilation of tex_filename next to it;
+    # returns whether they were in the cache
+    def restore_compiled(self, key, tex_filename):
+        path = self.get(key, 'compiled')
+        if path is None:
+            return False
+        root = os.path.splitext(tex_filename)[0]
+        for name in os.listdir(path):
+            shutil.copyfile(os.path.join(path, name), root + name)
+        return True
+
+    def store_compiled(self, key, tex_filename):
+        root = os.path.splitext(tex_filename)[0]
+        directory, base = os.path.split(root)
+        path = self.path(key, 'compiled')
+        tmp = path + '.%d.tmp' % os.getpid()
+        os.makedirs(tmp, exist_ok=True)
+        for name in os.listdir(directory or '.'):
+            suffix = name[len(base):]
+            if name.startswith(base) and (suffix == '.pdf' or (suffix.startswith('-figure') and suffix.endswith(('.pdf', '.png', '.md5', '.dpth')))):
+                shutil.copyfile(os.path.join(directory, name), os.path.join(tmp, suffix))
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp, path)
+
+    # removes the least recently used entries until the cache is not larger
+    # than its maximal size
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith('.tmp'):
+                continue
+            if os.path.isdir(path):
+                size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+            else:
+                size = os.path.getsize(path)
+            entries.append((os.stat(path).st_mtime, size, path))
+        total = sum(size for mtime, size, path in entries)
+        for mtime, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                os.remove(path)
+            total -= size
+
+# returns the hash of the bytes of the snapshot at offset of the mapped dump
+# file. the snapshot ends at end, or else before the next snapshot
+def hash_snapshot(mm, offset, end=None):
+    if end is None:
+        end = mm.find(b'\nITEM: TIMESTEP\n', offset)
+        end = mm.size() if end == -1 else end + 1
+    digest = hashlib.sha256()
+    with memoryview(mm) as view:
+        for start in range(offset, end, ATOMS_CHUNK_SIZE):
+            digest.update(view[start:min(start + ATOMS_CHUNK_SIZE, end)])
+    return digest.hexdigest()
+
+# reads the snapshot at byte offset of the dump file and writes its drawing to
+# out_filename; runs in the worker processes if several jobs are used. returns
+# out_filename, the layer documents written with it and the profile records of
+# the stages of the snapshot number frame (empty without profile option). end
+# is the end of the snapshot if it is known, e.g. while the dump is written
+def draw_frame(dump_filename, offset, out_filename, options, frame=None, end=None):
+    profiler = NO_PROFILER
+    if options.profile is not None:
+        profiler = Profiler(frame)
+    cache = None
+    if options.cache is not None:
+        cache = RenderCache(options.cache, options.cache_size)
+    with open(dump_filename, 'rb') as lammpsfile:
+        mm = mmap.mmap(lammpsfile.fileno(), 0, access=mmap.ACCESS_READ)
+        if cache is None:
+            header, types, xs, ys, zs = read_frame(dump_filename, mm, offset, options, profiler)
+        else:
+            selection = options.selection
+            snapshot_key = cache.key('snapshot', hash_snapshot(mm, offset, end), selection.region, sorted(selection.types) if selection.types is not None else None)
+            if restore_drawing(cache, snapshot_key, out_filename, options):
+                mm.close()
+                return out_filename, [], profiler.records
+            cached = cache.load_snapshot(snapshot_key)
+            if cached is None:
+                header, types, xs, ys, zs = read_frame(dump_filename, mm, offset, options, profiler)
+                cache.store_snapshot(snapshot_key, header, types, xs, ys, zs)
+            else:
+                print("Using cached atoms of snapshot")
+                header, types, xs, ys, zs = cached
+        mm.close()
+    layers = write_drawing(header, types, xs, ys, zs, out_filename, options, cache, snapshot_key if cache is not None else None, profiler)
+    return out_filename, layers, profiler.records
+
+# returns the hash of the box and the atoms of a snapshot that has been read
+def hash_columns(header, types, xs, ys, zs):
+    digest = hashlib.sha256(repr(header.box).encode())
+    for column in (types, xs, ys, zs):
+        digest.update(column)
+    return digest.hexdigest()
+
+# key of the drawing of the snapshot with snapshot_key in the render cache
+def tex_cache_key(cache, snapshot_key, options):
+    return cache.key('tex', snapshot_key, options.projection, options.orientation, options.target_width, options.target_height,
+                     options.pngexport, options.cull, options.compact)
+
+# writes the cached drawing of the snapshot with snapshot_key to out_filename
+# and returns True, or returns False if it is not cached. layered documents
+# are not cached, since they consist of several files
+def restore_drawing(cache, snapshot_key, out_filename, options):
+    if options.layer_size is not None:
+        return False
+    cached = cache.get(tex_cache_key(cache, snapshot_key, options), 'tex')
+    if cached is None:
+        return False
+    print("Using cached drawing of snapshot")
+    with open(cached, 'r') as cachefile:
+        write_if_changed(out_filename, cachefile.read())
+    return True
+
+# writes the drawing of the snapshot to out_filename. with a render cache, the
+# drawing order is taken from or stored in the cache, and the drawing is
+# stored in it under snapshot_key. returns the layer documents
+def write_drawing(header, types, xs, ys, zs, out_filename, options, cache=None, snapshot_key=None, profiler=NO_PROFILER):
+    if cache is None:
+        with open(out_filename, 'w') as outfile:
+            return draw_snapshot(header, types, xs, ys, zs, outfile, options, profiler=profiler)
+    order_key = cache.key('order', snapshot_key, options.projection, options.orientation, options.target_width, options.target_height, options.cull)
+    content = io.StringIO()
+    content.name = out_filename
+    layers = draw_snapshot(header, types, xs, ys, zs, content, options, cache, order_key, profiler)
+    # keep the modification time of an unchanged document
+    write_if_changed(out_filename, content.getvalue())
+    if options.layer_size is None:
+        cache.put(tex_cache_key(cache, snapshot_key, options), 'tex', content.getvalue().encode())
+    return layers
+
+# writes the drawing of a snapshot that has already been read (e.g. from a
+# dump stream) to out_filename; runs in the worker processes if several jobs
+# are used. records are the profile records of reading it. returns like
+# draw_frame
+def draw_read_frame(header, types, xs, ys, zs, out_filename, options, frame=None, records=()):
+    profiler = NO_PROFILER
+    if options.profile is not None:
+        profiler = Profiler(frame)
+        profiler.records.extend(records)
+    cache = None
+    snapshot_key = None
+    if options.cache is not None:
+        cache = RenderCache(options.cache, options.cache_size)
+        snapshot_key = cache.key('snapshot', hash_columns(header, types, xs, ys, zs))
+        if restore_drawing(cache, snapshot_key, out_filename, options):
+            return out_filename, [], profiler.records
+    layers = write_drawing(header, types, xs, ys, zs, out_filename, options, cache, snapshot_key, profiler)
+    return out_filename, layers, profiler.records
+
+# draws the snapshots of a compressed or binary dump file, which can only be
+# read front to back: the selected snapshots are read in order and drawn by
+# the worker processes, while at most two read snapshots per worker wait for
+# their drawing. finish_frame is called with the number and the result of
+# every drawn snapshot
+def draw_stream(dump_filename, out_filename, options, finish_frame):
+    frames = options.frames
+    if frames is None:
+        selected = range(1)
+    elif (frames.start or 0) < 0 or (frames.stop or 0) < 0:
+        # frames counted from the end need the number of snapshots
+        print("Counting snapshots ...")
+        stream = open_dump_stream(dump_filename)
+        count = 0
+        while not stream.at_end():
+            skip_snapshot(stream)
+            count += 1
+        stream.close()
+        selected = range(count)[frames]
+    else:
+        selected = range(sys.maxsize)[frames]
+    if options.grid is not None:
+        print("The spatial index is only used for uncompressed text dump files")
+    executor = None
+    if options.jobs > 1 and frames is not None:
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=options.jobs)
+    pending = {}
+    stream = open_dump_stream(dump_filename)
+    drawn = 0
+    try:
+        frame = 0
+        while len(selected) > 0 and frame <= selected[-1] and not stream.at_end():
+            if frame not in selected:
+                skip_snapshot(stream)
+                frame += 1
+                continue
+            profiler = NO_PROFILER
+            if options.profile is not None:
+                profiler = Profiler(frame)
+            snapshot = read_snapshot(stream, options.selection, profiler)
+            drawn += 1
+            frame_out_filename = out_filename if frames is None else frame_filename(out_filename, frame)
+            if executor is None:
+                finish_frame(frame, draw_read_frame(*snapshot, frame_out_filename, options, frame, profiler.records))
+            else:
+                while len(pending) >= 2 * options.jobs:
+                    done, not_done = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        finish_frame(pending.pop(future), future.result())
+                pending[executor.submit(draw_read_frame, *snapshot, frame_out_filename, options, frame, profiler.records)] = frame
+            del snapshot
+            frame += 1
+        for future in concurrent.futures.as_completed(pending):
+            finish_frame(pending[future], future.result())
+    finally:
+        stream.close()
+        if executor is not None:
+            executor.shutdown()
+    if frames is None and drawn == 0:
+        raise LammpsFileCorrupt("\n   ERROR: LAMMPS dump file contains no snapshot")
+
+# seconds between two looks at the size of a followed dump file
+FOLLOW_POLL_INTERVAL = 1.
+# number of lines of the header of a snapshot in a text dump
+HEADER_LINES = 9
+
+class SnapshotScanner:
+    # finds the snapshots that have been completely written to a growing text
+    # dump file. the scan of the snapshot being written is continued where it
+    # stopped, so every byte of the dump is scanned once
+    def __init__(self):
+        # start of the snapshot being written
+        self.offset = 0
+        # number of atoms of it; None while its header is incomplete
+        self.number_atoms = None
+        # end of the scanned part of the dump and number of atom lines in it
+        self.pos = 0
+        self.lines = 0
+        # start of the last completed snapshot
+        self.last_offset = None
+
+    # whether the dump file mapped by mm still starts its snapshots where they
+    # have been found. a rewritten dump may have grown beyond the scanned part
+    # before the next look at it
+    def matches(self, mm):
+        if self.pos == 0:
+            return True
+        for offset in (self.last_offset, self.offset):
+            if offset is not None and offset + 15 <= mm.size() and mm[offset:offset + 15] != b'ITEM: TIMESTEP\n':
+                return False
+        return True
+
+    # returns the start and the end of the snapshots completed in the mapped
+    # dump file mm since the last scan
+    def scan(self, mm):
+        offsets = []
+        size = mm.size()
+        while True:
+            if self.number_atoms is None:
+                end = self.offset
+                for i in range(HEADER_LINES):
+                    end = mm.find(b'\n', end, size)
+                    if end == -1:
+                        return offsets
+                    end += 1
+                mm.seek(self.offset)
+                if mm.read(5) != b'ITEM:':
+                    raise LammpsFileCorrupt("\n   ERROR: follow only reads uncompressed text dump files")
+                mm.seek(self.offset)
+                self.number_atoms = read_snapshot_header(mm).number_atoms
+                self.pos = mm.tell()
+                self.lines = 0
+            while self.lines < self.number_atoms:
+                end = min(self.pos + ATOMS_CHUNK_SIZE, size)
+                chunk = mm[self.pos:end]
+                nlines = chunk.count(b'\n')
+                if self.lines + nlines >= self.number_atoms:
+                    self.pos += nth_line_end(chunk, self.number_atoms - self.lines)
+                    self.lines = self.number_atoms
+                elif nlines == 0:
+                    # the last line is still being written
+                    return offsets
+                else:
+                    self.pos += chunk.rfind(b'\n') + 1
+                    self.lines += nlines
+            offsets.append((self.offset, self.pos))
+            self.last_offset = self.offset
+            self.offset = self.pos
+            self.number_atoms = None
+
+# draws the snapshots of the text dump file dump_filename while a running
+# simulation appends them, each one as soon as it is completely written, to
+# outputfile_NNNNN.tex. at most two snapshots per worker process wait for
+# their drawing; while they wait, the dump is not scanned further, so the
+# drawing can not fall behind without bound. following stops after
+# options.follow seconds without a new snapshot, after the last selected
+# frame, or with ctrl-c. finish_frame is called with the number and the result
+# of every drawn snapshot
+def follow_dump(dump_filename, out_filename, options, finish_frame):
+    frames = options.frames if options.frames is not None else slice(None)
+    if (frames.start or 0) < 0 or (frames.stop or 0) < 0:
+        raise InvalidFrames("\n ERROR: frames counted from the end can not be followed.")
+    selected = range(sys.maxsize)[frames]
+    executor = None
+    if options.jobs > 1:
+        # ctrl-c only stops the following; the workers finish their drawings
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=options.jobs, initializer=signal.signal, initargs=(signal.SIGINT, signal.SIG_IGN))
+    pending = {}
+    scanner = SnapshotScanner()
+    frame = 0
+    last_snapshot = time.monotonic()
+    print("Following " + dump_filename + " ...")
+    try:
+        while len(selected) > 0 and frame <= selected[-1]:
+            for future in [future for future in pending if future.done()]:
+                finish_frame(pending.pop(future), future.result())
+            try:
+                size = os.path.getsize(dump_filename)
+            except OSError:
+                size = 0
+            offsets = []
+            if size > 0:
+                with open(dump_filename, 'rb') as lammpsfile:
+                    mm = mmap.mmap(lammpsfile.fileno(), 0, access=mmap.ACCESS_READ)
+                    if mm.size() < scanner.pos or not scanner.matches(mm):
+                        print("Dump file was rewritten, following it from the start")
+                        scanner = SnapshotScanner()
+                        frame = 0
+                    if mm.size() > scanner.pos:
+                        offsets = scanner.scan(mm)
+                    mm.close()
+            elif scanner.pos > 0:
+                print("Dump file was rewritten, following it from the start")
+                scanner = SnapshotScanner()
+                frame = 0
+            if len(offsets) == 0:
+                if time.monotonic() - last_snapshot >= options.follow:
+                    print("No new snapshot for " + str(options.follow) + " seconds")
+                    break
+                time.sleep(FOLLOW_POLL_INTERVAL)
+                continue
+            last_snapshot = time.monotonic()
+            for offset, end in offsets:
+                if frame in selected:
+                    print("Drawing snapshot " + str(frame))
+                    frame_out_filename = frame_filename(out_filename, frame)
+                    if executor is None:
+                        finish_frame(frame, draw_frame(dump_filename, offset, frame_out_filename, options, frame, end))
+                    else:
+                        while len(pending) >= 2 * options.jobs:
+                            done, not_done = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                            for future in done:
+                                finish_frame(pending.pop(future), future.result())
+                        pending[executor.submit(draw_frame, dump_filename, offset, frame_out_filename, options, frame, end)] = frame
+                frame += 1
+    except KeyboardInterrupt:
+        print("Stopped following " + dump_filename)
+    for future in concurrent.futures.as_completed(pending):
+        finish_frame(pending[future], future.result())
+    if executor is not None:
+        executor.shutdown()
+
+# in-process drawing of atoms that are not read from a dump file, e.g. the
+# atoms of a running simulation from lammps.numpy.extract_atom, without
+# writing a dump and starting the program for every picture
+
+# returns values (a list, an array, or a numpy array) as an array of typecode.
+# contiguous one dimensional buffers of the same item type are copied at once
+def as_array(values, typecode):
+    column = array(typecode)
+    try:
+        view = memoryview(values)
+    except TypeError:
+        view = None
+    if view is not None and view.format == typecode and view.ndim == 1 and view.c_contiguous:
+        column.frombytes(view.cast('B'))
+    elif typecode == 'i':
+        column.extend(map(int, values))
+    else:
+        column.extend(map(float, values))
+    return column
+
+# returns the x, y, and z arrays of positions given as rows of x, y, and z,
+# like the N x 3 array of lammps.numpy.extract_atom("x")
+def position_columns(positions):
+    try:
+        view = memoryview(positions)
+    except TypeError:
+        view = None
+    if view is not None and view.format == 'd' and view.ndim == 2 and view.shape[1] == 3 and view.c_contiguous:
+        values = array('d')
+        values.frombytes(view.cast('B'))
+        return values[0::3], values[1::3], values[2::3]
+    return tuple(array('d', (float(p[i]) for p in positions)) for i in range(3))
+
+# returns the simulation box as (xlo, xhi, ylo, yhi, zlo, zhi); box is given
+# like that or starts with boxlo and boxhi like the result of lammps.extract_box()
+def box_bounds(box):
+    if len(box) == 6:
+        return tuple(float(c) for c in box)
+    boxlo, boxhi = box[0], box[1]
+    return (float(boxlo[0]), float(boxhi[0]), float(boxlo[1]), float(boxhi[1]), float(boxlo[2]), float(boxhi[2]))
+
+# returns the DrawOptions of the given settings, which are named and checked
+# like the command line arguments, e.g. draw_options(projection='isometric',
+# cull=True, width=5, region='sphere,0,0,0,10'). a setting of True is a
+# switch like cull, a setting of False or None is left out
+def draw_options(**settings):
+    args = []
+    for name, value in settings.items():
+        if value is True:
+            args.append(name)
+        elif value is not False and value is not None:
+            args.append(name + '=' + str(value))
+    return parse_arguments(args)
+
+# draws the atoms given by their types and their unscaled positions (see
+# position_columns) in the simulation box (see box_bounds) with options (see
+# draw_options). returns the tex document, or writes it to the file object
+# outfile and returns the layer documents written with it. layer_size needs an
+# outfile with a name, frames and compile are not used
+def draw_atoms(types, positions, box, outfile=None, options=None, timestep=0):
+    if options is None:
+        options = DrawOptions()
+    header = SnapshotHeader()
+    header.timestep = timestep
+    header.box = box_bounds(box)
+    header.x_coord_mode = header.y_coord_mode = header.z_coord_mode = 1
+    types = as_array(types, 'i')
+    xs, ys, zs = position_columns(positions)
+    if len(xs) != len(types):
+        raise InvalidAtoms("\n ERROR: " + str(len(types)) + " types are given for " + str(len(xs)) + " positions.")
+    header.number_atoms = len(types)
+    if not options.selection.selects_all():
+        types, xs, ys, zs = options.selection.apply(types, xs, ys, zs)
+        header.box = options.selection.clip_box(header.box)
+    if outfile is not None:
+        return draw_snapshot(header, types, xs, ys, zs, outfile, options)
+    if options.layer_size is not None:
+        raise InvalidLayerSize("\n ERROR: layer_size needs an output file.")
+    content = io.StringIO()
+    draw_snapshot(header, types, xs, ys, zs, content, options)
+    return content.getvalue()
+
+# reads snapshot number frame of the dump file filename (of any format) and
+# returns its header and the types and unscaled positions of its selected atoms
+def read_dump(filename, frame=0, selection=None):
+    if is_mapped_dump(filename):
+        with open(filename, 'rb') as lammpsfile:
+            mm = mmap.mmap(lammpsfile.fileno(), 0, access=mmap.ACCESS_READ)
+            if frame != 0:
+                offsets = load_frame_index(filename, mm)
+                if not -len(offsets) <= frame < len(offsets):
+                    raise InvalidFrames("\n ERROR: " + str(frame) + " is not an valid frame.")
+                mm.seek(offsets[frame])
+            snapshot = read_snapshot(mm, selection)
+            mm.close()
+        return snapshot
+    if frame < 0:
+        raise InvalidFrames("\n ERROR: " + str(frame) + " is not an valid frame.")
+    stream = open_dump_stream(filename)
+    try:
+        for i in range(frame):
+            if stream.at_end():
+                raise InvalidFrames("\n ERROR: " + str(frame) + " is not an valid frame.")
+            skip_snapshot(stream)
+        if stream.at_end():
+            raise InvalidFrames("\n ERROR: " + str(frame) + " is not an valid frame.")
+        return read_snapshot(stream, selection)
+    finally:
+        stream.close()
+
+# command used to compile the written documents. shell escape is needed for the
+# externalization of the pictures, which also runs the png export
+COMPILE_COMMAND = ['pdflatex', '-shell-escape', '-halt-on-error', '-interaction=batchmode']
+
+# compiles tex_filename in its directory; the output of pdflatex is written to
+# a log next to the document. returns the exit code (None if pdflatex could
+# not be started) and the name of the log
+def compile_document(tex_filename):
+    directory, name = os.path.split(os.path.abspath(tex_filename))
+    log_filename = os.path.splitext(tex_filename)[0] + '.compile.log'
+    with open(log_filename, 'w') as logfile:
+        try:
+            returncode = subprocess.call(COMPILE_COMMAND + [name], cwd=directory, stdout=logfile, stderr=subprocess.STDOUT)
+        except OSError as error:
+            logfile.write(str(error) + '\n')
+            returncode = None
+    return returncode, log_filename
+
+# whether the pdf of tex_filename is missing or older than the document or one
+# of the files it depends on
+def needs_compile(tex_filename, dependencies):
+    try:
+        pdf_mtime = os.stat(os.path.splitext(tex_filename)[0] + '.pdf').st_mtime
+    except OSError:
+        return True
+    return any(os.stat(f).st_mtime >= pdf_mtime for f in [tex_filename] + dependencies)
+
+# compiles tex_filename like compile_document and returns its profile record
+# together with the exit code and the log. the peak memory is the largest one
+# of the child processes waited for so far
+def profile_compile(tex_filename):
+    start = time.perf_counter()
+    returncode, log_filename = compile_document(tex_filename)
+    record = {
+        'frame': None,
+        'stage': 'compile',
+        'document': tex_filename,
+        'seconds': time.perf_counter() - start,
+        'atoms': None,
+        'atoms_per_second': None,
+        'peak_rss_mb': peak_rss(resource.RUSAGE_CHILDREN),
+    }
+    return returncode, log_filename, record
+
+# compiles all documents (pairs of the tex file and the files it depends on)
+# with at most jobs compilations at the same time and prints a summary of the
+# failed ones. with a render cache, the results of documents that have been
+# compiled before are taken from the cache. if a list of profile records is
+# given, a record of every compilation is appended to it. returns the number
+# of failures
+def compile_documents(documents, jobs, cache=None, records=None):
+    tex_filenames = [tex_filename for tex_filename, dependencies in documents]
+    keys = {}
+    if cache is not None:
+        for tex_filename, dependencies in documents:
+            keys[tex_filename] = cache.compile_key(tex_filename, dependencies)
+        cached = [tex_filename for tex_filename in tex_filenames if cache.restore_compiled(keys[tex_filename], tex_filename)]
+        if len(cached) > 0:
+            print("Using cached compilation of " + str(len(cached)) + " documents")
+        tex_filenames = [tex_filename for tex_filename in tex_filenames if tex_filename not in cached]
+    print("Compiling " + str(len(tex_filenames)) + " documents ...")
+    failures = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        results = executor.map(profile_compile, tex_filenames)
+        for done, (tex_filename, (returncode, log_filename, record)) in enumerate(zip(tex_filenames, results)):
+            if records is not None:
+                records.append(record)
+            notify_progress('compile', {'document': tex_filename, 'returncode': returncode, 'record': record, 'done': done + 1, 'total': len(tex_filenames)})
+            if returncode != 0:
+                failures.append((tex_filename, returncode, log_filename))
+            elif cache is not None:
+                cache.store_compiled(keys[tex_filename], tex_filename)
+    print("Compiled " + str(len(tex_filenames) - len(failures)) + " of " + str(len(tex_filenames)) + " documents")
+    for tex_filename, returncode, log_filename in failures:
+        if returncode is None:
+            print("  FAILED: " + tex_filename + " (pdflatex could not be started, see " + log_filename + ")")
+        else:
+            print("  FAILED: " + tex_filename + " (exit code " + str(returncode) + ", see " + log_filename + ")")
+    return len(failures)
+
+# draws (and compiles) the snapshots of the dump file given by the command line
+# argv. a 'frame' progress event is sent after every drawn snapshot. returns
+# the exit code
+def main(argv):
+    if len(argv) < 3:
+        raise NumberOfArgumentsError("\n ERROR: Wrong number of arguments.\n Usage: ./MainDraw.py lammps_file outputfile.tex arguments\n arguments are optional and can be:\n projection=[cabinet|isometric|dimetric]\n orientation=[xyz|zxy|yzx]\n png_export\n width=10\n height=10\n frames=start:stop:step\n compile\n jobs=1\n cull\n compact\n layer_size=100000\n region=[block,xlo,xhi,ylo,yhi,zlo,zhi|sphere,x,y,z,radius]\n types=1,2\n grid=16\n cache=directory\n cache_size=1024\n profile=outputfile.profile.json\n follow=seconds\n width and heigt have a default value of 10. the program keeps the aspect ratio, i.e. not both values are enforced but the more rigorous constraint determines the geometry of the output.\n frames selects the snapshots to draw (python slice of the snapshot numbers); each snapshot is written to outputfile_NNNNN.tex. Without frames only the first snapshot is drawn to outputfile.tex.\n compile runs pdflatex on the written files and jobs sets the number of processes used for drawing and compiling.\n cull leaves out hidden atoms, compact shades one ball per type, and layer_size splits the atoms into separately compiled layers of at most this many atoms.\n region and types select the atoms to draw; grid keeps a spatial index of each drawn snapshot with grid cells per direction, so that other regions of it are read faster.\n cache keeps parsed snapshots, drawing orders, tex files and compiled pictures in directory, at most cache_size MB.\n profile prints the time, atoms per second and peak memory of every stage and writes them as JSON to the given file (default outputfile.profile.json).\n lammps_file may be a text dump, a gzip or zstd compressed text dump, or a binary dump; compressed and binary dumps are read front to back while drawing.\n follow draws every snapshot of a text dump as soon as a running simulation has completely written it (to outputfile_NNNNN.tex) and stops after the given seconds without a new snapshot or with ctrl-c.")
+    options = parse_arguments(argv[3:])
+    profile_records = None
+    if options.profile is not None:
+        profile_records = []
+
+    cache = None
+    if options.cache is not None:
+        cache = RenderCache(options.cache, options.cache_size)
+
+    print("Reading LAMMPS dump file ...")
+    results = []
+    total = None
+    compile_failures = []
+    def finish_frame(frame, result):
+        tex_filename, layers, records = result
+        results.append((tex_filename, layers))
+        if profile_records is not None:
+            profile_records.extend(records)
+        notify_progress('frame', {'frame': frame, 'document': tex_filename, 'records': records, 'done': len(results), 'total': total})
+        if options.follow is not None and options.compile:
+            # a followed snapshot is compiled as soon as it is drawn
+            outdated_layers = [layer for layer in layers if needs_compile(*layer)]
+            if len(outdated_layers) > 0 and compile_documents(outdated_layers, options.jobs, cache, profile_records) > 0:
+                compile_failures.append(tex_filename)
+            elif compile_documents([(tex_filename, [f for layer in layers for f in [layer[0]] + layer[1]])], 1, cache, profile_records) > 0:
+                compile_failures.append(tex_filename)
+        if options.follow is not None and cache is not None:
+            # following may not end for a long time
+            cache.evict()
+    if options.follow is not None:
+        follow_dump(argv[1], argv[2], options, finish_frame)
+    elif not is_mapped_dump(argv[1]):
+        print("Streaming compressed or binary dump file")
+        draw_stream(argv[1], argv[2], options, finish_frame)
+    else:
+        if options.frames is None:
+            tasks = [(0, 0, argv[2])]
+        else:
+            with open(argv[1], 'rb') as lammpsfile:
+                mm = mmap.mmap(lammpsfile.fileno(), 0, access=mmap.ACCESS_READ)
+                offsets = load_frame_index(argv[1], mm)
+                mm.close()
+            selected = range(len(offsets))[options.frames]
+            print("Drawing " + str(len(selected)) + " of " + str(len(offsets)) + " snapshots")
+            tasks = [(frame, offsets[frame], frame_filename(argv[2], frame)) for frame in selected]
+        total = len(tasks)
+        if options.jobs == 1 or len(tasks) == 1:
+            for frame, offset, out_filename in tasks:
+                finish_frame(frame, draw_frame(argv[1], offset, out_filename, options, frame))
+        else:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=options.jobs) as executor:
+                futures = {executor.submit(draw_frame, argv[1], offset, out_filename, options, frame): frame for frame, offset, out_filename in tasks}
+                for future in concurrent.futures.as_completed(futures):
+                    finish_frame(futures[future], future.result())
+    # keep the documents in the order of the snapshots
+    results.sort()
+    # a document depends on its layers and on the files they depend on
+    documents = [(tex_filename, [f for layer in layers for f in [layer[0]] + layer[1]]) for tex_filename, layers in results]
+    layers = [layer for tex_filename, frame_layers in results for layer in frame_layers]
+    # a failed compilation still evicts the cache and writes the profile
+    failed = False
+    if options.compile and options.follow is not None:
+        if len(compile_failures) > 0:
+            print("Compiling failed for " + str(len(compile_failures)) + " snapshots")
+            failed = True
+    elif options.compile:
+        # layers are only compiled if they changed; they are needed by the documents
+        outdated_layers = [layer for layer in layers if needs_compile(*layer)]
+        if len(outdated_layers) > 0 and compile_documents(outdated_layers, options.jobs, cache, profile_records) > 0:
+            failed = True
+        elif compile_documents(documents, options.jobs, cache, profile_records) > 0:
+            failed = True
+    elif len(layers) > 0:
+        print("The layers have to be compiled with pdflatex before the documents")
+    if cache is not None:
+        cache.evict()
+    if profile_records is not None:
+        profile_filename = options.profile
+        if profile_filename == "":
+            profile_filename = os.path.splitext(argv[2])[0] + '.profile.json'
+        write_profile_report(profile_records, profile_filename)
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))